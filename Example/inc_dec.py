@@ -1,113 +1,49 @@
-import zmq
-
-import custom_lcd
-
-
-PLUS = 1
-MINUS = 23
-
-BCD0_A = 2
-BCD0_D = 3
-BCD0_C = 4
-BCD0_B = 5
-BCD0_F = 6
-BCD0_E = 7
-BCD0_G = 8
-
-BCD1_A = 9
-BCD1_D = 10
-BCD1_C = 11
-BCD1_B = 12
-BCD1_F = 13
-BCD1_E = 14
-BCD1_G = 15
-
-BCD2_A = 16
-BCD2_D = 17
-BCD2_C = 18
-BCD2_B = 19
-BCD2_F = 20
-BCD2_E = 21
-BCD2_G = 22
-
-
-TOUCH_PLUS = 1 << 6
-TOUCH_MINUS = 1 << 7
-
-context = zmq.Context()
-socket = context.socket(zmq.REQ)
-socket.connect("tcp://localhost:5555")
-
-socket.send(bytes((custom_lcd.I2C_LCD_ADDRESS, custom_lcd.I2C_LCD_READ_CMD)))
-led_state = socket.recv()
-led_state = bytes((0, 0, 0))
-
-value = 0
-
-def bcd_digits(value):
-    return [
-        1 << BCD0_A
-        | 1 << BCD0_B
-        | 1 << BCD0_C
-        | 1 << BCD0_D
-        | 1 << BCD0_E
-        | 1 << BCD0_F,
-        1 << BCD0_B | 1 << BCD0_C,
-        1 << BCD0_A | 1 << BCD0_B | 1 << BCD0_D | 1 << BCD0_E | 1 << BCD0_G,
-        1 << BCD0_A | 1 << BCD0_B | 1 << BCD0_C | 1 << BCD0_D | 1 << BCD0_G,
-        1 << BCD0_B | 1 << BCD0_C | 1 << BCD0_F | 1 << BCD0_G,
-        1 << BCD0_A | 1 << BCD0_C | 1 << BCD0_D | 1 << BCD0_F | 1 << BCD0_G,
-        1 << BCD0_A
-        | 1 << BCD0_C
-        | 1 << BCD0_D
-        | 1 << BCD0_E
-        | 1 << BCD0_F
-        | 1 << BCD0_G,
-        1 << BCD0_A | 1 << BCD0_B | 1 << BCD0_C,
-        1 << BCD0_A
-        | 1 << BCD0_B
-        | 1 << BCD0_C
-        | 1 << BCD0_D
-        | 1 << BCD0_E
-        | 1 << BCD0_F
-        | 1 << BCD0_G,
-        1 << BCD0_A
-        | 1 << BCD0_B
-        | 1 << BCD0_C
-        | 1 << BCD0_D
-        | 1 << BCD0_F
-        | 1 << BCD0_G,
-    ][value]
-
-
-
-while True:
-    socket.send(bytes((custom_lcd.I2C_TOUCH_ADDRESS, custom_lcd.I2C_TOUCH_READ_CMD)))
-    touch_state = int.from_bytes(socket.recv(), "little")
-    if touch_state:
-
-        if touch_state == TOUCH_PLUS and value < 120:
-            value += 1
-        elif touch_state == TOUCH_MINUS and value > 0:
-            value -= 1
-
-        led_state_int = 0
-
-        if value > 0:
-            led_state_int |=  1 << MINUS
-        if value < 120:
-            led_state_int |= 1 << PLUS
-
-        led_state_int |= bcd_digits(value % 10)
-        if value >= 10:
-            led_state_int |= bcd_digits((value // 10) % 10) << 7
-        if value >= 100:
-            led_state_int |= bcd_digits((value // 100) % 10) << 14
-
-        led_state = int.to_bytes(led_state_int, len(led_state), "big")
-
-        socket.send(
-            bytes((custom_lcd.I2C_LCD_ADDRESS, custom_lcd.I2C_LCD_WRITE_ALL_CMD))
-            + led_state
-        )
-        socket.recv()
+import asyncio
+import json
+
+import lcd_client
+from glyphs import compile_glyphs
+from layout_cache import load_layout_cached
+
+TOUCH_PLUS = 1
+TOUCH_MINUS = 0
+
+with open("3digitBCD_plusminus.glyphs.json", encoding="utf-8") as glyph_map:
+    GLYPHS = compile_glyphs(
+        load_layout_cached(
+            "3digitBCD_plusminus.svg", touch_class="touch", segment_class="segment"
+        ),
+        json.load(glyph_map),
+    )
+
+
+def led_state(value):
+    icons = []
+    if value > 0:
+        icons.append("minus")
+    if value < 120:
+        icons.append("plus")
+    return GLYPHS.render_number(value, icons)
+
+
+async def main():
+    client = lcd_client.AsyncLcdClient(
+        timeout=1.0,
+        retries=3,
+        interrupt_endpoint=lcd_client.DEFAULT_INTERRUPT_CONNECT_ENDPOINT,
+    )
+    value = 0
+    await client.write_all(led_state(value))
+
+    while True:
+        for event in await client.wait_touch_events():
+            if not event.pressed:
+                continue
+            if event.index == TOUCH_PLUS and value < 120:
+                value += 1
+            elif event.index == TOUCH_MINUS and value > 0:
+                value -= 1
+        await client.write_all(led_state(value))
+
+
+asyncio.run(main())
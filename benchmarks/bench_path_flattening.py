@@ -0,0 +1,74 @@
+"""Benchmark of layout load time and vertex count against flattening tolerance.
+
+The synthetic layout repeats a rounded 7-segment glyph, each copy placed with a
+transform, like a multi digit panel drawn in Inkscape. Run from the repository
+root:
+
+    python benchmarks/bench_path_flattening.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from layout import flatten_path, load_layout  # noqa: E402
+
+TOLERANCES = (2.0, 1.0, 0.5, 0.25, 0.1, 0.01)
+DIGITS = 200
+
+# Horizontal and vertical segment with rounded ends, and a round decimal point
+GLYPH_PATHS = (
+    "M 5,0 H 45 C 48,0 50,2 50,5 C 50,8 48,10 45,10 H 5 C 2,10 0,8 0,5 C 0,2 2,0 5,0 Z",
+    "M 0,5 Q 0,0 5,0 Q 10,0 10,5 V 45 Q 10,50 5,50 Q 0,50 0,45 Z",
+    "M 0,4 A 4,4 0 1 1 8,4 A 4,4 0 1 1 0,4 Z",
+)
+GLYPH_OFFSETS = ((10, 0), (0, 10), (55, 10), (10, 60), (0, 65), (55, 65), (10, 120))
+
+
+def write_layout(path: str) -> None:
+    """Write a layout with DIGITS rounded 7-segment digits and decimal points."""
+    with open(path, "w", encoding="utf-8") as svg:
+        svg.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" width="1000" height="1000">\n'
+        )
+        for digit in range(DIGITS):
+            x, y = (digit % 12) * 80, (digit // 12) * 140
+            svg.write(f'<g transform="translate({x},{y})">\n')
+            for idx, (dx, dy) in enumerate(GLYPH_OFFSETS):
+                path_data = GLYPH_PATHS[0] if idx % 3 == 0 else GLYPH_PATHS[1]
+                svg.write(
+                    f'<path class="segment" id="d{digit}s{idx}" d="{path_data}"'
+                    f' transform="translate({dx},{dy})"/>\n'
+                )
+            svg.write(
+                f'<path class="segment" id="d{digit}dp" d="{GLYPH_PATHS[2]}"'
+                ' transform="translate(66,125)"/>\n'
+            )
+            svg.write("</g>\n")
+        svg.write("</svg>\n")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rounded_digits.svg")
+        write_layout(path)
+
+        print(f"{'tolerance':>9} {'segments':>8} {'vertices':>9} {'load ms':>8}")
+        for tolerance in TOLERANCES:
+            flatten_path.cache_clear()
+            start = time.perf_counter()
+            layout = load_layout(path, segment_class="segment", tolerance=tolerance)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            vertices = sum(len(shape.coords) // 2 for shape in layout.segments)
+            print(
+                f"{tolerance:>9} {len(layout.segments):>8} {vertices:>9}"
+                f" {elapsed_ms:>8.1f}"
+            )
+        info = flatten_path.cache_info()
+        print(f"flattened {info.misses} distinct paths, {info.hits} memoised")
+
+
+if __name__ == "__main__":
+    main()
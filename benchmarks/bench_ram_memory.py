@@ -0,0 +1,99 @@
+"""Micro-benchmark of RamMemory against the original implementation.
+
+Run from the repository root:
+
+    python benchmarks/bench_ram_memory.py
+"""
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from ram_memory import RamMemory, np  # noqa: E402
+
+BIT_COUNTS = (24, 1024, 65536)
+
+
+class LegacyRamMemory:
+    """RamMemory as it was before the in-place rewrite, kept as the baseline."""
+
+    def __init__(self, bit_count: int):
+        self._memory = bytearray((bit_count + 7) // 8)
+        self._bit_count = bit_count
+
+    def write_from_bytes(self, data: bytes) -> bool:
+        old_state = copy.deepcopy(self._memory)
+        copy_length = min(len(data), len(self._memory))
+        self._memory[:copy_length] = data[:copy_length]
+        return old_state != self._memory
+
+    def toggle_bit(self, idx: int) -> None:
+        self._memory[idx // 8] ^= 0x80 >> (idx % 8)
+
+    def clear(self) -> None:
+        self._memory = bytearray(len(self._memory))
+
+    def iterate_bits(self):
+        for byte_index, byte_value in enumerate(self._memory):
+            binary_string = bin(byte_value)[2:].zfill(8)
+            for bit_index, bit_value in enumerate(binary_string):
+                index = byte_index * 8 + bit_index
+                if index >= self._bit_count:
+                    return
+                yield byte_index * 8 + bit_index, int(bit_value)
+
+
+def _cases(memory, bit_count):
+    # Two frames that differ in a single byte, like a digit changing on a panel
+    frame = bytes((i * 37) & 0xFF for i in range(bit_count // 8))
+    frames = [frame, frame[:1] + bytes((frame[1] ^ 0x7F,)) + frame[2:]]
+    every_8th = list(range(0, bit_count, 8))
+    cases = {
+        "write_from_bytes": lambda: [memory.write_from_bytes(f) for f in frames],
+        # Write and find the segments to redraw, the original scanned every bit
+        "write_and_find": lambda: [len(memory.write_from_bytes(f)) for f in frames],
+        "iterate_bits": lambda: sum(value for _, value in memory.iterate_bits()),
+        "clear": memory.clear,
+    }
+    if isinstance(memory, RamMemory):
+        cases["toggle_bits"] = lambda: memory.toggle_bits(every_8th)
+        if np is not None:
+            index_array = np.array(every_8th)
+            cases["toggle_bits[numpy]"] = lambda: memory.toggle_bits(index_array)
+            cases["unpack_bits[numpy]"] = memory.unpack_bits
+    else:
+        cases["toggle_bits"] = lambda: [memory.toggle_bit(idx) for idx in every_8th]
+        cases["write_and_find"] = lambda: [
+            memory.write_from_bytes(f) and sum(1 for _ in memory.iterate_bits())
+            for f in frames
+        ]
+    return cases
+
+
+def _time(func) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    print(f"{'bits':>6} {'operation':<20} {'legacy us':>11} {'new us':>11} {'gain':>7}")
+    for bit_count in BIT_COUNTS:
+        legacy = _cases(LegacyRamMemory(bit_count), bit_count)
+        for name, func in _cases(RamMemory(bit_count), bit_count).items():
+            new_us = _time(func) * 1e6
+            baseline = legacy.get(name.split("[")[0])
+            if baseline is None:
+                print(f"{bit_count:>6} {name:<20} {'':>11} {new_us:>11.2f}")
+                continue
+            legacy_us = _time(baseline) * 1e6
+            print(
+                f"{bit_count:>6} {name:<20} {legacy_us:>11.2f} {new_us:>11.2f}"
+                f" {legacy_us / new_us:>6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
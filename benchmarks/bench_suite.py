@@ -0,0 +1,255 @@
+"""Benchmark suite of the simulator against synthetic layouts of growing size.
+
+Measures per command process_message throughput, ZeroMQ round trip latency,
+redraw time, touch hit-test cost and startup time. Canvas benchmarks need a
+display and are skipped without one. Run from the repository root:
+
+    python benchmarks/bench_suite.py --sizes 100 1000 10000 --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tkinter as tk
+from typing import Callable, Dict, List
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from custom_lcd import CustomLCD  # noqa: E402
+from layout import load_layout  # noqa: E402
+from layout_cache import compile_layout, read_compiled  # noqa: E402
+from lcd_core import (  # noqa: E402
+    I2C_LCD_ADDRESS,
+    I2C_LCD_READ_CMD,
+    I2C_LCD_SET_MASK_CMD,
+    I2C_LCD_WRITE_ALL_CMD,
+    I2C_LCD_WRITE_RANGE_CMD,
+    I2C_LCD_WRITE_SINGLE_CMD,
+    I2C_TOUCH_ADDRESS,
+    I2C_TOUCH_READ_CMD,
+    LcdSimulator,
+    RasterRenderer,
+)
+from lcd_protocol import range_operation  # noqa: E402
+from synthetic_layout import (  # noqa: E402
+    SEGMENT_CLASS,
+    TOUCH_CLASS,
+    write_synthetic_layout,
+)
+
+DEFAULT_SIZES = (100, 1000, 10000)
+ROUND_TRIPS = 2000
+
+
+def _seconds_per_call(func: Callable[[], object]) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class Results:
+    """Collects benchmark records and prints them as they come in."""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+
+    def add(self, benchmark: str, segments: int, value: float, unit: str, **extra):
+        record = dict(benchmark=benchmark, segments=segments, value=value, unit=unit)
+        record.update(extra)
+        self.records.append(record)
+        label = " ".join([benchmark] + [str(v) for v in extra.values()])
+        print(f"{segments:>7} {label:<36} {value:>14.2f} {unit}")
+
+
+def bench_process_message(results: Results, simulator: LcdSimulator, segments: int):
+    """Throughput of process_message for each command."""
+    frame_bytes = (segments + 7) // 8
+    frames = [bytes(frame_bytes), bytes([0x81]) + bytes(frame_bytes - 1)]
+    write_all = [bytes((I2C_LCD_ADDRESS, I2C_LCD_WRITE_ALL_CMD)) + f for f in frames]
+    # Update a single digit worth of segments in the middle of the display
+    offset = frame_bytes // 2
+    write_range = [
+        bytes((I2C_LCD_ADDRESS,))
+        + range_operation(I2C_LCD_WRITE_RANGE_CMD, offset, bytes((value,)))
+        for value in (0x00, 0xFE)
+    ]
+    set_mask = [
+        bytes((I2C_LCD_ADDRESS,))
+        + range_operation(I2C_LCD_SET_MASK_CMD, offset, bytes((0x80,)))
+    ]
+    commands = {
+        "I2C_TOUCH_READ_CMD": [bytes((I2C_TOUCH_ADDRESS, I2C_TOUCH_READ_CMD))],
+        "I2C_LCD_READ_CMD": [bytes((I2C_LCD_ADDRESS, I2C_LCD_READ_CMD))],
+        "I2C_LCD_WRITE_ALL_CMD": write_all,
+        "I2C_LCD_WRITE_SINGLE_CMD": [
+            bytes((I2C_LCD_ADDRESS, I2C_LCD_WRITE_SINGLE_CMD, 0, 0))
+        ],
+        "I2C_LCD_WRITE_RANGE_CMD": write_range,
+        "I2C_LCD_SET_MASK_CMD": set_mask,
+    }
+    for command, messages in commands.items():
+        seconds = _seconds_per_call(
+            lambda: [simulator.process_message(m) for m in messages]
+        )
+        results.add(
+            "process_message",
+            segments,
+            len(messages) / seconds,
+            "msg/s",
+            command=command,
+        )
+
+
+def bench_round_trip(results: Results, simulator: LcdSimulator, segments: int):
+    """Latency of a REQ client talking to the simulator over tcp loopback."""
+    stop = threading.Event()
+
+    def serve():
+        poller = zmq.Poller()
+        poller.register(simulator.socket, zmq.POLLIN)
+        while not stop.is_set():
+            if poller.poll(50):
+                simulator.service_socket()
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+
+    client = zmq.Context.instance().socket(zmq.REQ)
+    client.setsockopt(zmq.LINGER, 0)
+    client.connect(simulator.socket.getsockopt_string(zmq.LAST_ENDPOINT))
+    message = bytes((I2C_LCD_ADDRESS, I2C_LCD_READ_CMD))
+    samples = []
+    for _ in range(ROUND_TRIPS):
+        start = time.perf_counter()
+        client.send(message)
+        client.recv()
+        samples.append(time.perf_counter() - start)
+    client.close()
+    stop.set()
+    server.join()
+
+    for percentile in (50, 99):
+        results.add(
+            "round_trip",
+            segments,
+            _percentile(samples, percentile) * 1e6,
+            "us",
+            percentile=f"p{percentile}",
+        )
+
+
+def bench_hit_test(results: Results, simulator: LcdSimulator, segments: int):
+    """Cost of finding the touch surfaces under a click, without pressing them."""
+    layout = simulator.lcd.layout
+    rng = random.Random(0)
+    points = [
+        (rng.uniform(0, layout.width), rng.uniform(0, layout.height))
+        for _ in range(1000)
+    ]
+    query = simulator.touch.index.query
+    seconds = _seconds_per_call(lambda: [query(x, y) for x, y in points])
+    results.add("hit_test", segments, seconds / len(points) * 1e6, "us")
+
+
+def bench_raster(results: Results, simulator: LcdSimulator, segments: int):
+    """Time of compositing a frame with the raster renderer."""
+    if RasterRenderer is None:
+        return
+    start = time.perf_counter()
+    renderer = RasterRenderer(simulator.lcd.layout)
+    results.add("raster_build", segments, (time.perf_counter() - start) * 1e3, "ms")
+    seconds = _seconds_per_call(lambda: renderer.compose(simulator.lcd.display_state))
+    results.add("raster_compose", segments, seconds * 1e3, "ms")
+
+
+def bench_canvas(results: Results, simulator: LcdSimulator, segments: int):
+    """Canvas build and redraw_all_masks time, needs a display."""
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        print(f"Skipping canvas benchmarks: {error}")
+        return
+
+    try:
+        start = time.perf_counter()
+        app = CustomLCD(
+            background=None,
+            mask=simulator.lcd.layout,
+            master=root,
+            simulator=simulator,
+            event_driven=False,
+            io_thread=False,
+        )
+        root.update()
+        results.add("canvas_build", segments, (time.perf_counter() - start) * 1e3, "ms")
+
+        def redraw():
+            app.redraw_all_masks()
+            root.update_idletasks()
+
+        results.add("redraw_all_masks", segments, _seconds_per_call(redraw) * 1e3, "ms")
+    finally:
+        root.destroy()
+
+
+def bench_startup(results: Results, svg_path: str, segments: int):
+    """Time of parsing the svg and of loading the compiled layout instead."""
+    start = time.perf_counter()
+    layout = load_layout(svg_path, TOUCH_CLASS, SEGMENT_CLASS)
+    results.add("svg_parse", segments, (time.perf_counter() - start) * 1e3, "ms")
+
+    compiled = compile_layout(layout)
+    seconds = _seconds_per_call(lambda: read_compiled(compiled))
+    results.add("compiled_load", segments, seconds * 1e3, "ms")
+    return layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--touches", type=int, default=64)
+    parser.add_argument("--json", help="write the results as json to this file")
+    args = parser.parse_args()
+
+    results = Results()
+    with tempfile.TemporaryDirectory() as directory:
+        for segments in args.sizes:
+            svg_path = os.path.join(directory, f"synthetic{segments}.svg")
+            write_synthetic_layout(svg_path, segments, args.touches)
+
+            layout = bench_startup(results, svg_path, segments)
+            simulator = LcdSimulator(layout, endpoint="tcp://127.0.0.1:*")
+            bench_process_message(results, simulator, segments)
+            bench_round_trip(results, simulator, segments)
+            bench_hit_test(results, simulator, segments)
+            bench_raster(results, simulator, segments)
+            bench_canvas(results, simulator, segments)
+            simulator.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(
+                {
+                    "timestamp": time.time(),
+                    "python": sys.version.split()[0],
+                    "results": results.records,
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
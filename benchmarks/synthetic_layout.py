@@ -0,0 +1,68 @@
+"""Generator of synthetic layout svgs with any number of segments and touches.
+
+Segments are laid out on a grid and alternate between <rect> and hexagonal
+<path> elements, touch areas are a grid of <rect> elements on top. Classes are
+`segment` and `touch` like in Example/3digitBCD_plusminus.svg.
+
+    python benchmarks/synthetic_layout.py 10000 layout.svg --touches 100
+"""
+import argparse
+import math
+
+SEGMENT_CLASS = "segment"
+TOUCH_CLASS = "touch"
+CELL_SIZE = 12
+
+
+def synthetic_layout_svg(segments: int, touches: int = 16) -> str:
+    """Get an svg document with the given number of segments and touch areas."""
+    columns = max(1, math.ceil(math.sqrt(segments)))
+    rows = max(1, math.ceil(segments / columns))
+    width, height = columns * CELL_SIZE, rows * CELL_SIZE
+
+    elements = [
+        '<svg xmlns="http://www.w3.org/2000/svg" version="1.1"'
+        f' width="{width}px" height="{height}px">'
+    ]
+    for idx in range(segments):
+        x, y = (idx % columns) * CELL_SIZE + 1, (idx // columns) * CELL_SIZE + 1
+        if idx % 2:
+            elements.append(
+                f'<path class="{SEGMENT_CLASS}" id="segment{idx}"'
+                f' d="M {x},{y + 5} l 3,-4 h 4 l 3,4 l -3,4 h -4 z"/>'
+            )
+        else:
+            elements.append(
+                f'<rect class="{SEGMENT_CLASS}" id="segment{idx}"'
+                f' x="{x}" y="{y}" width="10" height="10"/>'
+            )
+
+    touch_columns = max(1, math.ceil(math.sqrt(touches)))
+    touch_rows = max(1, math.ceil(touches / touch_columns))
+    touch_width, touch_height = width / touch_columns, height / touch_rows
+    for idx in range(touches):
+        elements.append(
+            f'<rect class="{TOUCH_CLASS}" id="touch{idx}"'
+            f' x="{(idx % touch_columns) * touch_width}"'
+            f' y="{(idx // touch_columns) * touch_height}"'
+            f' width="{touch_width}" height="{touch_height}"/>'
+        )
+
+    elements.append("</svg>")
+    return "\n".join(elements)
+
+
+def write_synthetic_layout(path: str, segments: int, touches: int = 16) -> None:
+    """Write a synthetic layout svg to a file."""
+    with open(path, "w", encoding="utf-8") as svg:
+        svg.write(synthetic_layout_svg(segments, touches))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("segments", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--touches", type=int, default=16)
+    args = parser.parse_args()
+
+    write_synthetic_layout(args.path, args.segments, args.touches)
@@ -0,0 +1,267 @@
+"""Timing model of the I2C bus and a profiler of the bus time per frame.
+
+A message is charged the time its transaction would take on an I2C bus: a start
+condition, the address byte, the command and payload bytes and a stop condition.
+A reply with data adds a repeated start, the address byte again and the reply
+bytes. Every byte takes 9 clock cycles, 8 data bits and the ACK, start, repeated
+start and stop take one cycle each, and the bus is free for the minimum time of
+the speed mode between two transactions. Reads are told from writes by their
+command, see `lcd_protocol.READ_COMMANDS`. Write acks are not sent on a real
+bus, and a message to an address without a device only costs the address byte
+nobody ACKs.
+"""
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from lcd_protocol import ILLEGAL_PREFIX, READ_COMMANDS
+
+STANDARD_MODE = 100_000
+FAST_MODE = 400_000
+FAST_MODE_PLUS = 1_000_000
+
+# Minimum bus free time between a stop and the next start, by clock rate
+BUS_FREE_TIME = {STANDARD_MODE: 4.7e-6, FAST_MODE: 1.3e-6, FAST_MODE_PLUS: 0.5e-6}
+BUS_SPEEDS = {"100k": STANDARD_MODE, "400k": FAST_MODE, "1M": FAST_MODE_PLUS}
+
+CYCLES_PER_BYTE = 9
+# Latest over budget frames kept for the summary
+FLAGGED_FRAMES = 8
+
+
+class I2cBusModel:
+    """Byte accurate transaction times on a bus clocked at `clock_hz`."""
+
+    def __init__(self, clock_hz: int = FAST_MODE):
+        self.clock_hz = clock_hz
+        self.cycle = 1 / clock_hz
+        self.free_time = BUS_FREE_TIME.get(clock_hz, 0.0)
+
+    @staticmethod
+    def is_read(message: bytes, reply: Optional[bytes]) -> bool:
+        """Get whether the transaction reads the reply back from the device."""
+        return (
+            len(message) > 1
+            and message[1] in READ_COMMANDS
+            and bool(reply)
+            and not reply.startswith(ILLEGAL_PREFIX)
+        )
+
+    def wire_bytes(
+        self, message: bytes, reply: Optional[bytes], acked: bool = True
+    ) -> int:
+        """Get the bytes of the transaction on the bus, address bytes included.
+
+        `acked` is whether a device has the address of the message.
+        """
+        if not acked:
+            return 1
+        if self.is_read(message, reply):
+            # The address byte again to read the reply
+            return len(message) + 1 + len(reply)
+        return len(message)
+
+    def transaction_cycles(
+        self, message: bytes, reply: Optional[bytes], acked: bool = True
+    ) -> int:
+        """Get the clock cycles of the transaction of a message and its reply."""
+        wire_bytes = self.wire_bytes(message, reply, acked)
+        # Start and stop, and a repeated start when reading
+        conditions = 3 if acked and self.is_read(message, reply) else 2
+        return CYCLES_PER_BYTE * wire_bytes + conditions
+
+    def transaction_time(
+        self, message: bytes, reply: Optional[bytes], acked: bool = True
+    ) -> float:
+        """Get the seconds the transaction of a message and its reply takes."""
+        cycles = self.transaction_cycles(message, reply, acked)
+        return cycles * self.cycle + self.free_time
+
+
+class CommandTime:
+    """Bus time of a single address and command."""
+
+    __slots__ = ("count", "bytes", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+
+class FlaggedFrame(NamedTuple):
+    """Frame whose bus time exceeded the budget."""
+
+    start: float
+    seconds: float
+    transactions: int
+    # Command key with the most bus time in the frame
+    busiest: str
+
+
+class BusProfiler:
+    """Charges every message its bus time, per device and command and per frame.
+
+    Frames are consecutive `frame_interval` windows of the time passed to
+    `record`. A frame with more bus time than `budget` seconds, by default the
+    whole frame, is flagged.
+    """
+
+    def __init__(
+        self,
+        model: I2cBusModel,
+        frame_interval: float,
+        budget: Optional[float] = None,
+    ):
+        self.model = model
+        self.frame_interval = frame_interval
+        self.budget = frame_interval if budget is None else budget
+        self.commands: Dict[str, CommandTime] = {}
+        self.seconds = 0.0
+        self.start: Optional[float] = None
+        self.last = 0.0
+        self.frames = 0
+        self.over_budget = 0
+        self.busiest_frame = 0.0
+        self.flagged: Deque[FlaggedFrame] = deque(maxlen=FLAGGED_FRAMES)
+        self._frame = -1
+        self._frame_seconds = 0.0
+        self._frame_transactions = 0
+        self._frame_commands: Dict[str, float] = {}
+
+    def record(
+        self,
+        message: bytes,
+        reply: Optional[bytes],
+        now: float,
+        acked: bool = True,
+    ) -> float:
+        """Charge a message and its reply at time `now` and get its bus time.
+
+        `acked` is whether a device has the address of the message.
+        """
+        seconds = self.model.transaction_time(message, reply, acked)
+        key = "/".join(f"0x{byte:02x}" for byte in message[:2])
+        command = self.commands.get(key)
+        if command is None:
+            command = self.commands[key] = CommandTime()
+        command.count += 1
+        command.bytes += self.model.wire_bytes(message, reply, acked)
+        command.seconds += seconds
+        self.seconds += seconds
+
+        if self.start is None:
+            self.start = now
+        self.last = now
+        frame = int(now // self.frame_interval)
+        if frame != self._frame:
+            self._close_frame()
+            self._frame = frame
+        self._frame_seconds += seconds
+        self._frame_transactions += 1
+        self._frame_commands[key] = self._frame_commands.get(key, 0.0) + seconds
+        return seconds
+
+    def _open_frame(self) -> Optional[FlaggedFrame]:
+        """Get the frame still taking messages, None when it has none."""
+        if not self._frame_transactions:
+            return None
+        return FlaggedFrame(
+            self._frame * self.frame_interval,
+            self._frame_seconds,
+            self._frame_transactions,
+            max(self._frame_commands, key=self._frame_commands.get),
+        )
+
+    def _close_frame(self) -> None:
+        frame = self._open_frame()
+        if frame is None:
+            return
+        self.frames += 1
+        self.busiest_frame = max(self.busiest_frame, frame.seconds)
+        if frame.seconds > self.budget:
+            self.over_budget += 1
+            self.flagged.append(frame)
+        self._frame_seconds = 0.0
+        self._frame_transactions = 0
+        self._frame_commands = {}
+
+    def frame_totals(self) -> Tuple[int, int, float, List[FlaggedFrame]]:
+        """Get the frames, frames over budget, busiest frame time and flagged
+        frames, counting the frame still taking messages without closing it."""
+        frames, over_budget = self.frames, self.over_budget
+        busiest = self.busiest_frame
+        flagged = deque(self.flagged, maxlen=FLAGGED_FRAMES)
+        frame = self._open_frame()
+        if frame is not None:
+            frames += 1
+            busiest = max(busiest, frame.seconds)
+            if frame.seconds > self.budget:
+                over_budget += 1
+                flagged.append(frame)
+        return frames, over_budget, busiest, list(flagged)
+
+    @property
+    def utilisation(self) -> float:
+        """Get the share of the time since the first message the bus was busy."""
+        if self.start is None:
+            return 0.0
+        elapsed = self.last - self.start + self.frame_interval
+        return self.seconds / elapsed
+
+    def device_seconds(self) -> Dict[str, float]:
+        """Get the bus time per device address."""
+        devices: Dict[str, float] = {}
+        for key, command in self.commands.items():
+            address = key.split("/")[0]
+            devices[address] = devices.get(address, 0.0) + command.seconds
+        return devices
+
+    def summary(self) -> Dict:
+        """Get the bus time and flagged frames as json serialisable dict."""
+        frames, over_budget, busiest, flagged = self.frame_totals()
+        return {
+            "clock_hz": self.model.clock_hz,
+            "utilisation": round(self.utilisation, 4),
+            "devices": {
+                address: round(seconds * 1e6, 1)
+                for address, seconds in sorted(self.device_seconds().items())
+            },
+            "commands": {
+                key: {
+                    "count": command.count,
+                    "bytes": command.bytes,
+                    "bus_us": round(command.seconds * 1e6, 1),
+                }
+                for key, command in sorted(self.commands.items())
+            },
+            "frames": frames,
+            "over_budget": over_budget,
+            "budget_us": round(self.budget * 1e6, 1),
+            "busiest_frame_us": round(busiest * 1e6, 1),
+            "flagged": [frame._asdict() for frame in flagged],
+        }
+
+    def format_summary(self) -> str:
+        """Get a human readable summary."""
+        frames, over_budget, busiest, flagged = self.frame_totals()
+        lines: List[str] = [
+            f"I2C at {self.model.clock_hz // 1000} kHz:"
+            f" {self.utilisation:.1%} utilisation, {over_budget} of"
+            f" {frames} frames over the {self.budget * 1e3:.2f} ms budget,"
+            f" busiest {busiest * 1e3:.2f} ms"
+        ]
+        for address, seconds in sorted(self.device_seconds().items()):
+            lines.append(f"{address}: {seconds / max(self.seconds, 1e-12):.1%} of bus")
+        for key, command in sorted(self.commands.items()):
+            lines.append(
+                f"{key}: {command.count} msgs, {command.bytes} B,"
+                f" {command.seconds * 1e3:.2f} ms on the bus,"
+                f" {command.seconds / command.count * 1e6:.1f} us each"
+            )
+        for frame in flagged:
+            lines.append(
+                f"over budget frame at {frame.start:.3f} s,"
+                f" {frame.seconds * 1e3:.2f} ms in {frame.transactions} msgs,"
+                f" mostly {frame.busiest}"
+            )
+        return "\n".join(lines)
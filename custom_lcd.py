@@ -1,192 +1,281 @@
 """Module for simulating a custom LCD interface."""
+import argparse
+import base64
 import contextlib
-import copy
+import time
 import tkinter as tk
 from tkinter import Canvas, PhotoImage
-from typing import Sequence, Tuple
-from xml.dom import minidom
-from svg.path import parse_path, Move, Line
-import zmq
-
-MASK_COLOR = "black"
-I2C_TOUCH_ADDRESS = 0x30
-I2C_LCD_ADDRESS = 0x32
-
-I2C_TOUCH_READ_CMD = 0x20
-
-I2C_LCD_READ_CMD = 0x40
-I2C_LCD_WRITE_ALL_CMD = 0x41
-I2C_LCD_WRITE_SINGLE_CMD = 0x42
-
+from typing import Iterable, List, Sequence
 
-class RamMemory:
-    """Block of RAM memory. """
-    def __init__(self, bit_count: int):
-        self._memory = bytearray((bit_count + 7) // 8)
-        self._bit_count = bit_count
-
-    def write_from_bytes(self, data:bytes) -> bool:
-        """Copy bytes to RAM object respecting the size of the bytearray."""
-        old_state = copy.deepcopy(self._memory)
-        copy_length = min(len(data), len(self._memory))
-        self._memory[:copy_length] = data[:copy_length]
-        return old_state != self._memory
-
-    def set_bit(self, idx: int) -> None:
-        """Set single bit of memory."""
-        self._memory[idx // 8] |= 0x80 >> (idx % 8)
-
-    def toggle_bit(self, idx: int) -> None:
-        """Toggle single bit of memory."""
-        self._memory[idx // 8] ^= 0x80 >> (idx % 8)
+import zmq
 
-    def as_bytes(self) -> bytes:
-        """Get entire memory as bytes."""
-        return bytes(self._memory)
+from layout import Layout, Shape
+from layout_cache import load_layout_cached
+from lcd_core import (  # noqa: F401 re-exported for the clients
+    DEFAULT_DOORBELL_ENDPOINT,
+    DEFAULT_ENDPOINT,
+    DEFAULT_INTERRUPT_ENDPOINT,
+    DEFAULT_REFRESH_RATE,
+    DEVICE_TYPES,
+    I2C_LCD_ADDRESS,
+    I2C_LCD_READ_CMD,
+    I2C_LCD_SNAPSHOT_CMD,
+    I2C_LCD_SNAPSHOT_PNG_CMD,
+    I2C_LCD_WRITE_ALL_CMD,
+    I2C_LCD_WRITE_SINGLE_CMD,
+    I2C_SIM_ADDRESS,
+    I2C_SIM_STATS_CMD,
+    I2C_TOUCH_ADDRESS,
+    I2C_TOUCH_READ_CMD,
+    I2C_TOUCH_READ_EVENTS_CMD,
+    RATE_REPORT_INTERVAL_MS,
+    FrameCoalescer,
+    LcdSimulator,
+    ThreadedFrameCoalescer,
+    add_simulator_arguments,
+    simulator_from_args,
+)
+from palette import TRANSPARENT, Palette, hex_color, make_palette
+
+try:
+    from raster import RasterRenderer
+except ImportError:  # numpy is optional, only needed for the raster renderer
+    RasterRenderer = None
 
-    def clear(self) -> None:
-        """Clear all memory to 0."""
-        self._memory = bytearray(len(self._memory))
+MASK_COLOR = "black"
 
-    def iterate_bits(self) -> Tuple[int, int]:
-        """Iterate over each bit in RAM memory and get each bit index and value."""
-        for byte_index, byte_value in enumerate(self._memory):
-            binary_string = bin(byte_value)[2:].zfill(8)
-            for bit_index, bit_value in enumerate(binary_string):
-                index = byte_index * 8 + bit_index
-                if index >= self._bit_count:
-                    return
-                yield byte_index * 8 + bit_index, int(bit_value)
+POLL_INTERVAL_MS = 50
 
 
 class CustomLCD(tk.Frame):
-    """Custom LCD class."""
-
-    def __init__(self, background, mask, master=None, *args, **kwargs):
+    """Custom LCD class, Tk view on a `LcdSimulator`.
+
+    `mask` is a layout svg path or an already loaded `Layout`. Lit segments are
+    drawn with `on_fill` and unlit ones with `off_fill`, by default the segments
+    mask the `background` image when off. Displays with several bits per segment
+    draw each value with its color of the "gray" or "rgb" `palette`, or of a list
+    of colors. The canvas renderer ignores partial transparency, use the raster
+    renderer for intensities that fade to transparent.
+
+    The "canvas" renderer draws each segment as canvas item, the "raster" renderer
+    composites the whole display into one image per frame, which scales to tens of
+    thousands of segments.
+
+    Writes are applied to the display RAM at full speed, but rendered at most
+    `refresh_rate` times per second, each frame showing the union of the changes
+    since the previous one. A refresh rate of 0 renders every write.
+
+    With `io_thread` the simulator serves the bus on a background thread, so a
+    slow redraw or a dragged window never delays a reply. The Tk thread then
+    polls for a changed display once per frame, every millisecond with a refresh
+    rate of 0, and touches are handed to the I/O thread.
+    """
+
+    def __init__(
+        self,
+        background,
+        mask,
+        master=None,
+        *args,
+        simulator=None,
+        event_driven=True,
+        on_fill="",
+        off_fill=MASK_COLOR,
+        bg_color=None,
+        renderer="canvas",
+        refresh_rate=DEFAULT_REFRESH_RATE,
+        io_thread=True,
+        palette="gray",
+        **kwargs,
+    ):
         super().__init__(master, *args, **kwargs)
 
+        layout = mask if isinstance(mask, Layout) else load_layout_cached(mask)
+        self.simulator = simulator or LcdSimulator(layout)
+        self.on_fill, self.off_fill = on_fill, off_fill
+        bits_per_element = self.simulator.lcd.display_state.bits_per_element
+
         self.pack(fill="both", expand=True)
-        self.background = PhotoImage(file=background)
-        master.geometry(f"{self.background.width()}x{self.background.height()}+100+100")
+        if background:
+            self.background = PhotoImage(file=background)
+            width, height = self.background.width(), self.background.height()
+        else:
+            self.background = None
+            width, height = layout.width, layout.height
+        master.geometry(f"{width}x{height}+100+100")
 
-        self.canvas = Canvas(
-            self, width=self.background.width(), height=self.background.height()
-        )
+        self.canvas = Canvas(self, width=width, height=height, bg=bg_color)
         self.canvas.pack(fill="both", expand=True)
 
-        self.canvas.create_image(0, 0, image=self.background, anchor="nw")
+        if self.background:
+            self.canvas.create_image(0, 0, image=self.background, anchor="nw")
 
-        mask_svg = minidom.parse(mask)
-        self.touch_surfaces = self.add_rects_from_svg(mask_svg, init_fill="")
-        self.masks = self.add_rects_from_svg(
-            mask_svg, init_fill=MASK_COLOR
-        ) + self.add_paths_from_svg(mask_svg, init_fill=MASK_COLOR)
+        self.touch_surfaces = self.add_shapes(layout.touches, init_fill="")
+        if isinstance(palette, str):
+            self.palette = make_palette(
+                palette, bits_per_element, self.rgba(on_fill), self.rgba(off_fill)
+            )
+        elif isinstance(palette, Palette):
+            self.palette = palette
+        else:
+            self.palette = make_palette([self.rgba(color) for color in palette])
+        # The 1 bit gray scale fills as given, "" leaves a segment transparent
+        self.fills = (
+            [off_fill, on_fill] if bits_per_element == 1 and palette == "gray" else None
+        )
+        if renderer == "raster":
+            if RasterRenderer is None:
+                raise ImportError("numpy is required for the raster renderer")
+            self.raster = RasterRenderer(
+                layout,
+                width,
+                height,
+                palette=self.palette,
+            )
+            # Snapshots show the same frames as the view
+            self.simulator.lcd.renderer = self.raster
+            self.frame_image = PhotoImage(width=width, height=height)
+            self.canvas.create_image(0, 0, image=self.frame_image, anchor="nw")
+            self.masks = []
+        else:
+            self.raster = None
+            self.masks = self.add_shapes(layout.segments, init_fill=off_fill)
 
-        self.touch_state = RamMemory(len(self.touch_surfaces))
-        self.display_state = RamMemory(len(self.masks))
+        self.touch_state = self.simulator.touch.touch_state
+        self.display_state = self.simulator.lcd.display_state
 
         self.redraw_all_masks()
+        self.io_thread = io_thread
+        self._reported_updates = 0
+        if io_thread:
+            self.frames = ThreadedFrameCoalescer(self.display_state)
+            self.frame_interval = 1 / refresh_rate if refresh_rate else 0.001
+            self.simulator.lcd.redraw_latency = None
+            self.simulator.lcd.subscribe(self.frames.add)
+            self.master.after_idle(self.poll_frame)
+        elif refresh_rate:
+            self.frames = FrameCoalescer()
+            self.frame_interval = 1 / refresh_rate
+            self._frame_scheduled = False
+            self._next_frame = time.monotonic()
+            # Time the rendered frames rather than collecting the changes
+            self.simulator.lcd.redraw_latency = None
+            self.simulator.lcd.subscribe(self.schedule_frame)
+        else:
+            self.frames = FrameCoalescer()
+            self.simulator.lcd.subscribe(self.redraw_masks)
 
         self.canvas.bind("<Button-1>", self.click_event)
+        # Dragging presses the touch surfaces entered and releases the ones left
+        self.canvas.bind("<B1-Motion>", self.click_event)
+        self.canvas.bind("<ButtonRelease-1>", self.release_event)
+
+        self.socket = self.simulator.socket
+        if io_thread:
+            self.simulator.start()
+        elif not (event_driven and self.watch_socket()):
+            self.receive_message()
+        self.master.after(RATE_REPORT_INTERVAL_MS, self.report_rate)
+
+    def watch_socket(self) -> bool:
+        """Let the Tk event loop wake us when the socket becomes readable.
+
+        Returns False when the platform has no file handler support (Windows).
+        """
+        handlers = [(self.socket, self.simulator.service_socket)]
+        if self.simulator.doorbell is not None:
+            handlers.append((self.simulator.doorbell, self.simulator.service_doorbell))
+        try:
+            for socket, service in handlers:
+                self.master.tk.createfilehandler(
+                    socket.getsockopt(zmq.FD),
+                    tk.READABLE,
+                    lambda *_, service=service: service(),
+                )
+        except (AttributeError, NotImplementedError, tk.TclError):
+            return False
 
-        context = zmq.Context()
-        self.socket = context.socket(zmq.REP)
-        self.socket.bind("tcp://*:5555")
-
-        self.receive_message()
+        # zmq.FD is edge triggered, anything queued before now won't wake us
+        for _, service in handlers:
+            self.master.after_idle(service)
+        return True
 
     def receive_message(self):
-        """Read bytes and always reply."""
-        with contextlib.suppress(zmq.Again):
-            message = self.socket.recv(flags=zmq.NOBLOCK)
-            self.socket.send(self.process_message(message))
-        self.master.after(50, self.receive_message)
-
-    def process_message(self, message: bytes) -> bytes:
-        """Process a received message and reply."""
-        if message[0] == I2C_TOUCH_ADDRESS:
-            if message[1] == I2C_TOUCH_READ_CMD:
-                reply = self.touch_state.as_bytes()
-                self.touch_state.clear()
-                return reply
-        elif message[0] == I2C_LCD_ADDRESS:
-            if message[1] == I2C_LCD_READ_CMD:
-                return self.display_state.as_bytes()
-            if message[1] == I2C_LCD_WRITE_SINGLE_CMD:
-                self.display_state.toggle_bit(message[3])
-                self.redraw_single_mask(message[2], message[3])
-                return bytes((I2C_LCD_ADDRESS, I2C_LCD_WRITE_SINGLE_CMD))
-            if message[1] == I2C_LCD_WRITE_ALL_CMD:
-                any_change = self.display_state.write_from_bytes(message[2:])
-                if any_change:
-                    self.redraw_all_masks()
-                return bytes((I2C_LCD_ADDRESS, I2C_LCD_WRITE_ALL_CMD))
-        else:
-            return b"Illegal: " + message
-
-    def add_rects_from_svg(
-        self, svg: minidom.Document, init_fill: str
-    ) -> Sequence[int]:
-        """Add each <rect> element from an svg"""
-        rectangles = []
-
-        # Loop through all the <rect> elements in the SVG
-        for rect in svg.getElementsByTagName("rect"):
-            # Get the x, y, width, and height attributes for this rectangle
-            x = int(rect.getAttribute("x"))
-            y = int(rect.getAttribute("y"))
-            width = int(rect.getAttribute("width"))
-            height = int(rect.getAttribute("height"))
-
-            # Add the rectangle to the canvas
-            rectangles.append(
-                self.canvas.create_rectangle(
-                    x,
-                    y,
-                    x + width,
-                    y + height,
-                    fill=init_fill,
-                    outline="",
-                    tags=[rect.getAttribute("id")],
-                )
+        """Read bytes and always reply, polling fallback for watch_socket."""
+        self.simulator.service_socket()
+        if self.simulator.doorbell is not None:
+            self.simulator.service_doorbell()
+        self.master.after(POLL_INTERVAL_MS, self.receive_message)
+
+    def report_rate(self):
+        """Print the achieved transactions per second and statistics if enabled."""
+        if not self.io_thread:
+            # The I/O thread reports by itself
+            self.simulator.report()
+        if self.frames.updates != self._reported_updates:
+            self._reported_updates = self.frames.updates
+            print(
+                f"{self.frames.updates} display updates in {self.frames.frames}"
+                f" frames, {self.frames.coalesced} coalesced"
             )
-
-        # Update the image with the current state of the canvas
-        self.canvas.itemconfigure(self.background, image=self.canvas)
-
-        return rectangles
-
-    def add_paths_from_svg(
-        self, svg: minidom.Document, init_fill: str
-    ) -> Sequence[int]:
-        """Add each <path> element from an svg."""
-        paths = [
-            self.canvas.create_polygon(
-                *parse_path_data(
-                    path_data=path.getAttribute("d"),
-                    transform=path.getAttribute("transform"),
-                ),
-                fill=init_fill,
-                outline="",
-                tags=[path.getAttribute("id")],
+        self.master.after(RATE_REPORT_INTERVAL_MS, self.report_rate)
+
+    def schedule_frame(self, changed: Iterable[int]):
+        """Collect changed segments and render them with the next frame."""
+        self.frames.add(changed)
+        if self._frame_scheduled:
+            return
+        self._frame_scheduled = True
+        delay_ms = max(0, int((self._next_frame - time.monotonic()) * 1000))
+        self.master.after(delay_ms, self.render_frame)
+
+    def poll_frame(self):
+        """Render a frame when the I/O thread changed the display."""
+        if self.frames.dirty:
+            self.render_frame()
+        self.master.after(max(1, int(self.frame_interval * 1000)), self.poll_frame)
+
+    def render_frame(self):
+        """Render all changes since the previous frame."""
+        self._frame_scheduled = False
+        start = time.monotonic()
+        self._next_frame = start + self.frame_interval
+        self.redraw_masks(self.frames.take())
+        if self.simulator.stats is not None:
+            self.simulator.stats.redraw.add(time.monotonic() - start)
+
+    def add_shapes(self, shapes: Sequence[Shape], init_fill: str) -> List[int]:
+        """Add a canvas item for each shape of the layout."""
+        create = {
+            "rect": self.canvas.create_rectangle,
+            "polygon": self.canvas.create_polygon,
+        }
+        return [
+            create[shape.kind](
+                *shape.coords, fill=init_fill, outline="", tags=[shape.id]
             )
-            for path in svg.getElementsByTagName("path")
+            for shape in shapes
         ]
 
-        # Update the image with the current state of the canvas
-        self.canvas.itemconfigure(self.background, image=self.canvas)
-
-        return paths
-
     def click_event(self, event):
         """On click event find touch surfaces."""
-        for idx, surface in enumerate(self.touch_surfaces):
-            x1, y1, x2, y2 = self.canvas.coords(surface)
-            if x1 <= event.x <= x2 and y1 <= event.y <= y2:
-                print(f"Touch surface {surface} was touched!")
-                # print(self.canvas.itemcget(surface, "tags"))
-                # self.toggle_item(surface)
-                self.touch_state.set_bit(idx)
+        self.touch_call(self.move_touch, event.x, event.y)
+
+    def move_touch(self, x: int, y: int):
+        """Press the touch surfaces at a point and release the others."""
+        for idx in self.simulator.touch.move_to([(x, y)]):
+            print(f"Touch surface {self.touch_surfaces[idx]} was touched!")
+
+    def release_event(self, event):
+        """On button release lift all touches."""
+        self.touch_call(self.simulator.touch.release_all)
+
+    def touch_call(self, callback, *args):
+        """Change the touch state on the thread that owns it."""
+        if self.io_thread:
+            self.simulator.call_soon(callback, *args)
+        else:
+            callback(*args)
 
     def toggle_item(self, item):
         """Hide or show the item using the fill color."""
@@ -196,41 +285,87 @@ class CustomLCD(tk.Frame):
             self.canvas.itemconfigure(item, fill="")
         self.canvas.itemconfigure(self.background, image=self)
 
-    def redraw_single_mask(self, item_id, state):
-        """Turn on/off single mask element."""
-        with contextlib.suppress(IndexError):
-            self.canvas.itemconfigure(
-                self.masks[item_id], fill="" if state else MASK_COLOR
-            )
-            self.canvas.itemconfigure(self.background, image=self)
+    def rgba(self, color):
+        """Get the RGBA value of a Tk color, "" is transparent."""
+        if not isinstance(color, str):
+            return tuple(color)
+        if color in ("", "none"):
+            return TRANSPARENT
+        red, green, blue = self.winfo_rgb(color)
+        return red >> 8, green >> 8, blue >> 8, 255
+
+    def fill(self, value):
+        """Get the canvas fill of a segment value."""
+        if self.fills is not None:
+            return self.fills[value]
+        return hex_color(self.palette[value])
+
+    def redraw_frame(self):
+        """Composite the display and push it to the frame image."""
+        png = self.raster.render_png(self.display_state)
+        self.frame_image.configure(data=base64.b64encode(png).decode(), format="png")
+
+    def redraw_masks(self, indices: Iterable[int]):
+        """Turn on/off only the given mask elements."""
+        if self.raster:
+            self.redraw_frame()
+            return
+        for idx in indices:
+            with contextlib.suppress(IndexError):
+                value = self.display_state.get_element(idx)
+                self.canvas.itemconfigure(self.masks[idx], fill=self.fill(value))
 
     def redraw_all_masks(self):
         """Turn on/off mask elements."""
-        for idx, value in self.display_state.iterate_bits():
-            self.canvas.itemconfigure(self.masks[idx], fill="" if value else MASK_COLOR)
-
-        self.canvas.itemconfigure(self.background, image=self)
-
-
-def parse_path_data(path_data: str, transform: str) -> Sequence[Tuple[int, int]]:
-    """Parse svg path data and get coordinates."""
-    path = parse_path(path_data)
-
-    if transform:
-        raise NotImplementedError("Not implemented (yet)")
-
-    return [
-        (int(segment.end.real), int(segment.end.imag))
-        for segment in path
-        if isinstance(segment, (Move, Line))
-    ]
+        if self.raster:
+            self.redraw_frame()
+            return
+        for idx, value in self.display_state.iterate_elements():
+            self.canvas.itemconfigure(self.masks[idx], fill=self.fill(value))
 
 
 if __name__ == "__main__":
-    root = tk.Tk()
-
-    # Remove the window border and title bar
-    # root.overrideredirect(True)
-
-    app = CustomLCD(master=root, background="background.png", mask="Masked.svg")
-    app.mainloop()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--background", default="background.png")
+    parser.add_argument(
+        "--poll", action="store_true", help="poll the socket instead of event driven"
+    )
+    parser.add_argument(
+        "--gui-thread",
+        action="store_true",
+        help="serve the bus on the Tk thread instead of a background I/O thread",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="serve without a GUI, like python lcd_core.py which needs no Tk",
+    )
+    parser.add_argument("--renderer", choices=("canvas", "raster"), default="canvas")
+    add_simulator_arguments(parser)
+    args = parser.parse_args()
+
+    simulator = simulator_from_args(args)
+    try:
+        if args.headless:
+            simulator.serve_forever()
+        else:
+            root = tk.Tk()
+
+            # Remove the window border and title bar
+            # root.overrideredirect(True)
+
+            app = CustomLCD(
+                master=root,
+                background=args.background,
+                mask=simulator.lcd.layout,
+                simulator=simulator,
+                event_driven=not args.poll,
+                renderer=args.renderer,
+                refresh_rate=args.refresh_rate,
+                io_thread=not args.gui_thread,
+                palette=args.palette,
+            )
+            app.mainloop()
+    finally:
+        # Flushes the traffic log
+        simulator.close()
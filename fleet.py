@@ -0,0 +1,260 @@
+"""Fleet of headless simulators over a process pool, for load tests.
+
+Each panel is a headless `LcdSimulator` with its own endpoint, from a port range
+or as IPC paths. The panels are sharded over one process per core, each process
+serving all of its panels from a single poll loop. The layout is parsed and
+compiled once into a shared memory block, each process decodes its own copy of
+the shapes from it when starting and then closes the block. The processes
+report their statistics, which are printed as fleet totals:
+
+    python fleet.py --mask Masked.svg --count 200 --base-port 6000
+    python fleet.py --mask Masked.svg --count 200 --ipc-dir /tmp/lcd-fleet
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import zmq
+
+from layout_cache import compile_layout, load_layout_cached, read_compiled
+from lcd_core import RATE_REPORT_INTERVAL_MS, LcdSimulator
+from lcd_stats import SimulatorStats
+
+DEFAULT_BASE_PORT = 6000
+# Longest a process serves before it notices the fleet stopping
+STOP_CHECK_MS = 200
+
+
+def instance_endpoints(
+    count: int,
+    base_port: int = DEFAULT_BASE_PORT,
+    ipc_dir: Optional[str] = None,
+    host: str = "*",
+) -> List[str]:
+    """Get the endpoints of `count` panels, consecutive ports or IPC paths."""
+    if ipc_dir:
+        return [
+            f"ipc://{os.path.join(ipc_dir, f'lcd-{idx}.sock')}" for idx in range(count)
+        ]
+    return [f"tcp://{host}:{base_port + idx}" for idx in range(count)]
+
+
+class ShardReport(NamedTuple):
+    """Totals of the panels of one process since it started."""
+
+    shard: int
+    transactions: int
+    stats: SimulatorStats
+
+
+def serve_shard(
+    shard: int,
+    layout_name: str,
+    endpoints: List[str],
+    reports,
+    stop,
+    router: bool = False,
+    report_interval: float = RATE_REPORT_INTERVAL_MS / 1000,
+) -> None:
+    """Serve the panels of one process until `stop` is set.
+
+    The totals are put on the `reports` queue every `report_interval` seconds
+    and once more when stopping.
+    """
+    # The launcher handles ^C and stops the fleet
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Children share the resource tracker of the launcher, which removes the block
+    block = shared_memory.SharedMemory(layout_name)
+    # The shapes are decoded to a copy per process, the block is only read here
+    try:
+        layout = read_compiled(block.buf.toreadonly())
+    finally:
+        block.close()
+
+    context = zmq.Context()
+    simulators = [
+        LcdSimulator(layout, endpoint, router=router, context=context, stats=True)
+        for endpoint in endpoints
+    ]
+    poller = zmq.Poller()
+    by_socket = {}
+    for simulator in simulators:
+        poller.register(simulator.socket, zmq.POLLIN)
+        by_socket[simulator.socket] = simulator
+
+    def report() -> None:
+        stats = SimulatorStats()
+        for simulator in simulators:
+            stats.merge(simulator.stats)
+        transactions = sum(simulator.transaction_count for simulator in simulators)
+        reports.put(ShardReport(shard, transactions, stats))
+
+    try:
+        next_report = time.monotonic() + report_interval
+        while not stop.is_set():
+            timeout_ms = max(0.0, next_report - time.monotonic()) * 1000
+            for socket, _ in poller.poll(min(timeout_ms, STOP_CHECK_MS)):
+                by_socket[socket].service_socket()
+            if time.monotonic() >= next_report:
+                report()
+                next_report = time.monotonic() + report_interval
+        report()
+    finally:
+        for simulator in simulators:
+            simulator.close()
+        context.term()
+
+
+class Fleet:
+    """Launches the panels over `processes` processes, by default one per core.
+
+    `collect` gathers the reports of the processes, `totals` sums the latest.
+    """
+
+    def __init__(
+        self,
+        layout,
+        endpoints: List[str],
+        processes: Optional[int] = None,
+        router: bool = False,
+        report_interval: float = RATE_REPORT_INTERVAL_MS / 1000,
+    ):
+        self.endpoints = endpoints
+        processes = min(processes or os.cpu_count() or 1, len(endpoints))
+        compiled = compile_layout(layout)
+        self.layout_block = shared_memory.SharedMemory(
+            f"lcd_fleet_{os.getpid()}", create=True, size=len(compiled)
+        )
+        self.layout_block.buf[: len(compiled)] = compiled
+
+        self._reports = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._latest: Dict[int, ShardReport] = {}
+        self.processes = [
+            multiprocessing.Process(
+                target=serve_shard,
+                args=(
+                    shard,
+                    self.layout_block.name,
+                    endpoints[shard::processes],
+                    self._reports,
+                    self._stop,
+                    router,
+                    report_interval,
+                ),
+                name=f"lcd-fleet-{shard}",
+                daemon=True,
+            )
+            for shard in range(processes)
+        ]
+
+    def start(self) -> None:
+        """Start the processes."""
+        for process in self.processes:
+            process.start()
+
+    def totals(self) -> Tuple[int, SimulatorStats]:
+        """Get the transactions and statistics of the fleet as last reported."""
+        stats = SimulatorStats()
+        for report in self._latest.values():
+            stats.merge(report.stats)
+        return sum(report.transactions for report in self._latest.values()), stats
+
+    def collect(self, timeout: Optional[float] = None) -> bool:
+        """Wait for reports of the processes and get whether any arrived."""
+        try:
+            report = self._reports.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        self._latest[report.shard] = report
+        while True:
+            try:
+                report = self._reports.get_nowait()
+            except queue.Empty:
+                return True
+            self._latest[report.shard] = report
+
+    def stop(self) -> None:
+        """Stop the processes, collect their final reports and free the layout."""
+        self._stop.set()
+        deadline = time.monotonic() + 5
+        # Drain the reports so no process blocks flushing its queue on exit
+        while time.monotonic() < deadline and any(
+            process.is_alive() for process in self.processes
+        ):
+            self.collect(timeout=0.1)
+        for process in self.processes:
+            if process.pid is not None:
+                process.join(timeout=1)
+        self.collect(timeout=0)
+        self.layout_block.close()
+        self.layout_block.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mask", default="Masked.svg")
+    parser.add_argument("--touch-class")
+    parser.add_argument("--segment-class")
+    parser.add_argument("--count", type=int, default=100, help="number of panels")
+    parser.add_argument(
+        "--processes", type=int, help="processes to shard over, by default one per core"
+    )
+    parser.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT)
+    parser.add_argument("--host", default="*", help="interface to bind the ports on")
+    parser.add_argument("--ipc-dir", help="serve on IPC paths in this directory")
+    parser.add_argument("--router", action="store_true")
+    parser.add_argument(
+        "--endpoints-file", help="write the endpoint of each panel to this file"
+    )
+    args = parser.parse_args()
+
+    endpoints = instance_endpoints(args.count, args.base_port, args.ipc_dir, args.host)
+    if args.ipc_dir:
+        os.makedirs(args.ipc_dir, exist_ok=True)
+    if args.endpoints_file:
+        with open(args.endpoints_file, "w", encoding="utf-8") as endpoints_file:
+            for endpoint in endpoints:
+                print(endpoint.replace("*", "localhost"), file=endpoints_file)
+
+    fleet = Fleet(
+        load_layout_cached(args.mask, args.touch_class, args.segment_class),
+        endpoints,
+        processes=args.processes,
+        router=args.router,
+    )
+    fleet.start()
+    print(
+        f"{len(endpoints)} panels on {len(fleet.processes)} processes,"
+        f" {endpoints[0]} to {endpoints[-1]}"
+    )
+    start = time.monotonic()
+    reported = (start, 0)
+    next_report = start + RATE_REPORT_INTERVAL_MS / 1000
+    try:
+        while True:
+            fleet.collect(timeout=max(0.0, next_report - time.monotonic()))
+            if time.monotonic() < next_report:
+                continue
+            next_report += RATE_REPORT_INTERVAL_MS / 1000
+            transactions, stats = fleet.totals()
+            now = time.monotonic()
+            rate = (transactions - reported[1]) / (now - reported[0])
+            reported = (now, transactions)
+            print(f"{transactions} transactions, {rate:.1f} transactions/s")
+            if stats.commands:
+                print(stats.format_summary())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.stop()
+        transactions, stats = fleet.totals()
+        print(
+            f"{transactions} transactions in {time.monotonic() - start:.1f} s"
+            f" over {len(endpoints)} panels"
+        )
@@ -0,0 +1,268 @@
+"""Glyph compiler, renders numbers and text to a display RAM image.
+
+A glyph map declares the digit positions of a display, left to right, with the
+font of each and the layout svg id of every segment, plus named icons:
+
+    {
+        "digits": [
+            {"font": "7seg", "segments": {"a": "path20", "b": "path14", ...}},
+            ...
+        ],
+        "icons": {"plus": "path50", "minus": "rect52"}
+    }
+
+Compiling resolves the ids to bit indices and precomputes, per position, the
+RAM image of every character as an integer. Rendering then only ORs one table
+entry per character, and the result is sent with a single I2C_LCD_WRITE_ALL_CMD.
+
+7-segment fonts use segments a-g and dp. 14-segment fonts use a-f for the outer
+segments, g1 and g2 for the left and right middle, h, i and j for the upper
+left diagonal, centre and right diagonal, k, l and m for the lower ones, and
+dp. Compile a glyph map to tables with:
+
+    python glyphs.py layout.svg glyphs.json --touch-class touch --segment-class segment
+"""
+import argparse
+import json
+from typing import Dict, Iterable, List, Mapping, Sequence
+
+SEVEN_SEGMENT = {
+    "0": "abcdef",
+    "1": "bc",
+    "2": "abdeg",
+    "3": "abcdg",
+    "4": "bcfg",
+    "5": "acdfg",
+    "6": "acdefg",
+    "7": "abc",
+    "8": "abcdefg",
+    "9": "abcdfg",
+    "A": "abcefg",
+    "b": "cdefg",
+    "C": "adef",
+    "c": "deg",
+    "d": "bcdeg",
+    "E": "adefg",
+    "F": "aefg",
+    "G": "acdef",
+    "H": "bcefg",
+    "h": "cefg",
+    "I": "ef",
+    "J": "bcde",
+    "L": "def",
+    "n": "ceg",
+    "o": "cdeg",
+    "P": "abefg",
+    "q": "abcfg",
+    "r": "eg",
+    "S": "acdfg",
+    "t": "defg",
+    "U": "bcdef",
+    "u": "cde",
+    "y": "bcdfg",
+    "-": "g",
+    "_": "d",
+    "=": "dg",
+    " ": "",
+}
+
+FOURTEEN_SEGMENT = {
+    "0": "a b c d e f j k",
+    "1": "b c j",
+    "2": "a b d e g1 g2",
+    "3": "a b c d g2",
+    "4": "b c f g1 g2",
+    "5": "a c d f g1 g2",
+    "6": "a c d e f g1 g2",
+    "7": "a b c",
+    "8": "a b c d e f g1 g2",
+    "9": "a b c d f g1 g2",
+    "A": "a b c e f g1 g2",
+    "B": "a b c d g2 i l",
+    "C": "a d e f",
+    "D": "a b c d i l",
+    "E": "a d e f g1",
+    "F": "a e f g1",
+    "G": "a c d e f g2",
+    "H": "b c e f g1 g2",
+    "I": "a d i l",
+    "J": "b c d e",
+    "K": "e f g1 j m",
+    "L": "d e f",
+    "M": "b c e f h j",
+    "N": "b c e f h m",
+    "O": "a b c d e f",
+    "P": "a b e f g1 g2",
+    "Q": "a b c d e f m",
+    "R": "a b e f g1 g2 m",
+    "S": "a c d f g1 g2",
+    "T": "a i l",
+    "U": "b c d e f",
+    "V": "e f j k",
+    "W": "b c e f k m",
+    "X": "h j k m",
+    "Y": "h j l",
+    "Z": "a d j k",
+    "-": "g1 g2",
+    "+": "g1 g2 i l",
+    "*": "g1 g2 h i j k l m",
+    "/": "j k",
+    "_": "d",
+    " ": "",
+}
+
+# Segments of each character, by font name
+FONTS = {
+    "7seg": {char: tuple(segments) for char, segments in SEVEN_SEGMENT.items()},
+    "14seg": {
+        char: tuple(segments.split()) for char, segments in FOURTEEN_SEGMENT.items()
+    },
+}
+
+
+class GlyphTables:
+    """Precomputed RAM images of the characters of each digit position and icons.
+
+    Each image is an integer holding the RAM bytes big-endian, so bit index n of
+    the display is integer bit `bit_count_rounded - 1 - n`.
+    """
+
+    def __init__(
+        self,
+        bit_count: int,
+        digits: Sequence[Mapping[str, int]],
+        icons: Mapping[str, int],
+        decimal_points: Sequence[int] = (),
+    ):
+        self.bit_count = bit_count
+        self.byte_count = (bit_count + 7) // 8
+        self.digits = [dict(table) for table in digits]
+        self.icons = dict(icons)
+        self.decimal_points = list(decimal_points) or [0] * len(self.digits)
+
+    def image(self, text: str = "", icons: Iterable[str] = ()) -> int:
+        """Get the RAM image of text, left aligned, and icons as integer.
+
+        A "." lights the decimal point of the position before it when it has one.
+        """
+        image = 0
+        position = -1
+        for char in text:
+            if char == "." and position >= 0 and self.decimal_points[position]:
+                image |= self.decimal_points[position]
+                continue
+            position += 1
+            if position >= len(self.digits):
+                raise ValueError(f"{text!r} does not fit {len(self.digits)} digits")
+            table = self.digits[position]
+            glyph = table.get(char)
+            if glyph is None:
+                glyph = table.get(char.upper(), table.get(char.lower()))
+            if glyph is None:
+                raise ValueError(f"No glyph for {char!r} at digit {position}")
+            image |= glyph
+        for icon in icons:
+            image |= self.icons[icon]
+        return image
+
+    def render(self, text: str = "", icons: Iterable[str] = ()) -> bytes:
+        """Get the display RAM with text, left aligned, and icons lit."""
+        return self.image(text, icons).to_bytes(self.byte_count, "big")
+
+    def render_number(
+        self, value: int, icons: Iterable[str] = (), zero_pad: bool = False
+    ) -> bytes:
+        """Get the display RAM with a number right aligned and icons lit."""
+        text = str(value)
+        width = len(self.digits) + text.count(".")
+        text = text.rjust(width, "0" if zero_pad else " ")
+        return self.render(text, icons)
+
+    def to_json(self) -> Dict:
+        """Get the tables as json serialisable dict, with hexadecimal images."""
+        return {
+            "bit_count": self.bit_count,
+            "digits": [
+                {char: f"{image:x}" for char, image in table.items()}
+                for table in self.digits
+            ],
+            "decimal_points": [f"{image:x}" for image in self.decimal_points],
+            "icons": {name: f"{image:x}" for name, image in self.icons.items()},
+        }
+
+    @classmethod
+    def from_json(cls, tables: Dict) -> "GlyphTables":
+        """Get tables from `to_json` output, no layout or svg parsing needed."""
+        return cls(
+            tables["bit_count"],
+            [
+                {char: int(image, 16) for char, image in table.items()}
+                for table in tables["digits"]
+            ],
+            {name: int(image, 16) for name, image in tables["icons"].items()},
+            [int(image, 16) for image in tables["decimal_points"]],
+        )
+
+
+def compile_glyphs(
+    layout, glyph_map: Mapping, fonts: Mapping[str, Mapping] = FONTS
+) -> GlyphTables:
+    """Compile a glyph map against the segment ids of a layout.
+
+    A character whose glyph needs a segment a position does not have, like "."
+    without a decimal point, is left out of the table of that position.
+    """
+    bit_count = len(layout.segments)
+    top_bit = (bit_count + 7) // 8 * 8 - 1
+    indices = {segment.id: idx for idx, segment in enumerate(layout.segments)}
+
+    def image(segment_id: str) -> int:
+        try:
+            return 1 << (top_bit - indices[segment_id])
+        except KeyError:
+            raise ValueError(f"No segment with id {segment_id!r} in layout") from None
+
+    digits: List[Dict[str, int]] = []
+    decimal_points: List[int] = []
+    for digit in glyph_map.get("digits", ()):
+        segments = {name: image(id_) for name, id_ in digit["segments"].items()}
+        font = fonts[digit["font"]]
+        digits.append(
+            {
+                char: sum(segments[name] for name in glyph)
+                for char, glyph in font.items()
+                if all(name in segments for name in glyph)
+            }
+        )
+        decimal_points.append(segments.get("dp", 0))
+    icons = {name: image(id_) for name, id_ in glyph_map.get("icons", {}).items()}
+    return GlyphTables(bit_count, digits, icons, decimal_points)
+
+
+def load_glyph_tables(path: str) -> GlyphTables:
+    """Load tables written by the command line compiler."""
+    with open(path, encoding="utf-8") as tables:
+        return GlyphTables.from_json(json.load(tables))
+
+
+if __name__ == "__main__":
+    from layout_cache import load_layout_cached
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("layout", help="layout svg")
+    parser.add_argument("glyph_map", help="glyph map json")
+    parser.add_argument("--touch-class")
+    parser.add_argument("--segment-class")
+    parser.add_argument("--output", help="write the tables to this json file")
+    args = parser.parse_args()
+
+    with open(args.glyph_map, encoding="utf-8") as glyph_map:
+        tables = compile_glyphs(
+            load_layout_cached(args.layout, args.touch_class, args.segment_class),
+            json.load(glyph_map),
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(tables.to_json(), output, indent=2)
+    else:
+        print(json.dumps(tables.to_json(), indent=2))
@@ -0,0 +1,303 @@
+"""Geometry of an LCD layout SVG, independent of any GUI toolkit."""
+import functools
+import math
+import re
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+
+from svg.path import parse_path, Arc, CubicBezier, Line, Move, QuadraticBezier
+
+# Affine transform (a, b, c, d, e, f) mapping x, y to a*x + c*y + e, b*x + d*y + f
+Transform = Tuple[float, float, float, float, float, float]
+IDENTITY: Transform = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+_TRANSFORM_RE = re.compile(r"(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)")
+_NUMBER_SEPARATOR_RE = re.compile(r"[\s,]+")
+
+# Maximum distance in pixels between a curve and its flattened polygon
+DEFAULT_TOLERANCE = 0.25
+_MAX_SUBDIVISIONS = 16
+
+
+class Shape(NamedTuple):
+    """Single segment or touch area.
+
+    `coords` are flat like the Tk canvas expects them: the two corners of a rect or
+    the vertices of a polygon.
+    """
+
+    id: str
+    kind: str
+    coords: Tuple[float, ...]
+
+
+class Layout(NamedTuple):
+    """All segments and touch areas of a layout, in document order."""
+
+    width: int
+    height: int
+    touches: Sequence[Shape]
+    segments: Sequence[Shape]
+
+
+def load_layout(
+    path: str,
+    touch_class: Optional[str] = None,
+    segment_class: Optional[str] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> Layout:
+    """Load the geometry from a layout svg.
+
+    Without a class filter every <rect> is a touch area and every <rect> and <path>
+    is a segment, otherwise only the elements with the given css class are used
+    and touch areas can also be a <path>. Rects come before paths in both lists.
+
+    The svg is streamed, each element is dropped as soon as its geometry has been
+    extracted, so memory use does not grow with the size of the document. Curves
+    are flattened to within `tolerance` pixels.
+    """
+    width = height = 0
+    shapes = {
+        (group, tag): [] for group in ("touch", "segment") for tag in ("rect", "path")
+    }
+    # Open elements with the transform to apply to their content
+    stack: List[Tuple[ElementTree.Element, Transform]] = []
+
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        tag = element.tag.rpartition("}")[2]
+        if event == "start":
+            transform = stack[-1][1] if stack else IDENTITY
+            if element.get("transform"):
+                transform = multiply(
+                    transform, parse_transform(element.get("transform"))
+                )
+            if not stack:
+                width = _pixel_size(element.get("width", ""))
+                height = _pixel_size(element.get("height", ""))
+            stack.append((element, transform))
+            continue
+
+        _, transform = stack.pop()
+        if tag in ("rect", "path"):
+            classes = element.get("class", "").split()
+            if touch_class in classes or (not touch_class and tag == "rect"):
+                shapes["touch", tag].append(_shape(tag, element, transform, tolerance))
+            if not segment_class or segment_class in classes:
+                shapes["segment", tag].append(
+                    _shape(tag, element, transform, tolerance)
+                )
+
+        element.clear()
+        if stack:
+            stack[-1][0].remove(element)
+
+    return Layout(
+        width=width,
+        height=height,
+        touches=shapes["touch", "rect"] + shapes["touch", "path"],
+        segments=shapes["segment", "rect"] + shapes["segment", "path"],
+    )
+
+
+def _pixel_size(value: str) -> int:
+    match = re.search(r"^\d+", value)
+    return int(match.group(0)) if match else 0
+
+
+def _shape(
+    tag: str, element: ElementTree.Element, transform: Transform, tolerance: float
+) -> Shape:
+    if tag == "rect":
+        return rect_shape(element, transform)
+    return Shape(
+        element.get("id", ""),
+        "polygon",
+        apply(transform, flatten_path(element.get("d", ""), tolerance)),
+    )
+
+
+def rect_shape(element: ElementTree.Element, transform: Transform = IDENTITY) -> Shape:
+    """Get the shape of a <rect> element, a polygon if rotated or skewed."""
+    x = float(element.get("x", 0))
+    y = float(element.get("y", 0))
+    width = float(element.get("width"))
+    height = float(element.get("height"))
+
+    if transform[1] or transform[2]:
+        corners = (x, y, x + width, y, x + width, y + height, x, y + height)
+        return Shape(element.get("id", ""), "polygon", apply(transform, corners))
+
+    x1, y1, x2, y2 = apply(transform, (x, y, x + width, y + height))
+    return Shape(
+        element.get("id", ""),
+        "rect",
+        (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)),
+    )
+
+
+def parse_path_data(
+    path_data: str, transform="", tolerance: float = DEFAULT_TOLERANCE
+) -> Sequence[Tuple[float, float]]:
+    """Parse svg path data and get coordinates.
+
+    `transform` is a svg transform attribute value or an already parsed Transform.
+    """
+    if isinstance(transform, str):
+        transform = parse_transform(transform)
+    coords = apply(transform, flatten_path(path_data, tolerance))
+    return list(zip(coords[0::2], coords[1::2]))
+
+
+@functools.lru_cache(maxsize=4096)
+def flatten_path(path_data: str, tolerance: float) -> Tuple[float, ...]:
+    """Get the flat vertex coordinates of svg path data.
+
+    Curves and arcs are subdivided until they are within `tolerance` of their
+    chords. Results are memoised, so glyphs repeated in a layout with a different
+    transform are flattened once.
+    """
+    coords = []
+    for segment in parse_path(path_data):
+        if isinstance(segment, CubicBezier):
+            _flatten_bezier(
+                (segment.start, segment.control1, segment.control2, segment.end),
+                tolerance,
+                coords,
+            )
+        elif isinstance(segment, QuadraticBezier):
+            _flatten_bezier(
+                (segment.start, segment.control, segment.end), tolerance, coords
+            )
+        elif isinstance(segment, Arc):
+            _flatten_arc(segment, tolerance, coords)
+        elif not isinstance(segment, (Move, Line)):
+            continue
+        coords += (segment.end.real, segment.end.imag)
+    return tuple(coords)
+
+
+def _distance_to_chord(point: complex, start: complex, end: complex) -> float:
+    chord = end - start
+    if not chord:
+        return abs(point - start)
+    return abs((chord.conjugate() * (point - start)).imag) / abs(chord)
+
+
+def _flatten_bezier(
+    points: Tuple[complex, ...], tolerance: float, coords: List[float], depth: int = 0
+) -> None:
+    """Add the inner vertices of a flattened bezier curve, the end point excluded."""
+    start, end = points[0], points[-1]
+    if depth >= _MAX_SUBDIVISIONS or all(
+        _distance_to_chord(control, start, end) <= tolerance for control in points[1:-1]
+    ):
+        return
+
+    # De Casteljau subdivision at t=0.5
+    left, right = [points[0]], [points[-1]]
+    while len(points) > 1:
+        points = [(a + b) / 2 for a, b in zip(points, points[1:])]
+        left.append(points[0])
+        right.append(points[-1])
+    middle = points[0]
+
+    _flatten_bezier(tuple(left), tolerance, coords, depth + 1)
+    coords += (middle.real, middle.imag)
+    _flatten_bezier(tuple(reversed(right)), tolerance, coords, depth + 1)
+
+
+def _flatten_arc(arc: Arc, tolerance: float, coords: List[float]) -> None:
+    """Add the inner vertices of a flattened arc, the end point excluded."""
+    # Start with pieces of at most 45 degrees so a midpoint test can't be fooled
+    pieces = max(1, math.ceil(abs(arc.delta) / 45))
+    for piece in range(pieces):
+        _flatten_parametric(
+            arc.point, piece / pieces, (piece + 1) / pieces, tolerance, coords
+        )
+        if piece < pieces - 1:
+            point = arc.point((piece + 1) / pieces)
+            coords += (point.real, point.imag)
+
+
+def _flatten_parametric(
+    curve, t1: float, t2: float, tolerance: float, coords: List[float], depth: int = 0
+) -> None:
+    t_middle = (t1 + t2) / 2
+    middle = curve(t_middle)
+    if (
+        depth >= _MAX_SUBDIVISIONS
+        or _distance_to_chord(middle, curve(t1), curve(t2)) <= tolerance
+    ):
+        return
+    _flatten_parametric(curve, t1, t_middle, tolerance, coords, depth + 1)
+    coords += (middle.real, middle.imag)
+    _flatten_parametric(curve, t_middle, t2, tolerance, coords, depth + 1)
+
+
+def parse_transform(value: str) -> Transform:
+    """Parse a svg transform attribute into a single affine transform."""
+    transform = IDENTITY
+    for name, arguments in _TRANSFORM_RE.findall(value):
+        numbers = [float(n) for n in _NUMBER_SEPARATOR_RE.split(arguments.strip()) if n]
+        transform = multiply(transform, _TRANSFORM_PARSERS[name](*numbers))
+    return transform
+
+
+def _translate(tx: float, ty: float = 0.0) -> Transform:
+    return (1.0, 0.0, 0.0, 1.0, tx, ty)
+
+
+def _scale(sx: float, sy: Optional[float] = None) -> Transform:
+    return (sx, 0.0, 0.0, sx if sy is None else sy, 0.0, 0.0)
+
+
+def _rotate(angle: float, cx: float = 0.0, cy: float = 0.0) -> Transform:
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    rotation = (cos, sin, -sin, cos, 0.0, 0.0)
+    if cx or cy:
+        return multiply(multiply(_translate(cx, cy), rotation), _translate(-cx, -cy))
+    return rotation
+
+
+def _skew_x(angle: float) -> Transform:
+    return (1.0, 0.0, math.tan(math.radians(angle)), 1.0, 0.0, 0.0)
+
+
+def _skew_y(angle: float) -> Transform:
+    return (1.0, math.tan(math.radians(angle)), 0.0, 1.0, 0.0, 0.0)
+
+
+_TRANSFORM_PARSERS = {
+    "matrix": lambda a, b, c, d, e, f: (a, b, c, d, e, f),
+    "translate": _translate,
+    "scale": _scale,
+    "rotate": _rotate,
+    "skewX": _skew_x,
+    "skewY": _skew_y,
+}
+
+
+def multiply(first: Transform, second: Transform) -> Transform:
+    """Get the transform applying `second` first and then `first`."""
+    a1, b1, c1, d1, e1, f1 = first
+    a2, b2, c2, d2, e2, f2 = second
+    return (
+        a1 * a2 + c1 * b2,
+        b1 * a2 + d1 * b2,
+        a1 * c2 + c1 * d2,
+        b1 * c2 + d1 * d2,
+        a1 * e2 + c1 * f2 + e1,
+        b1 * e2 + d1 * f2 + f1,
+    )
+
+
+def apply(transform: Transform, coords: Sequence[float]) -> Tuple[float, ...]:
+    """Transform a batch of flat x, y coordinates."""
+    if transform == IDENTITY:
+        return tuple(coords)
+    a, b, c, d, e, f = transform
+    return tuple(
+        coordinate
+        for x, y in zip(coords[0::2], coords[1::2])
+        for coordinate in (a * x + c * y + e, b * x + d * y + f)
+    )
@@ -0,0 +1,223 @@
+"""Compiled binary cache of layout geometry for fast startup.
+
+A compiled layout holds the ids and flattened coordinates of all touch areas and
+segments in packed arrays. It is keyed by a hash of the svg content and the
+loader options, so a warm start skips all XML and path parsing.
+
+Format, all little endian::
+
+    header     magic, version, width, height, touch count, segment count,
+               id blob size, coordinate count
+    kinds      uint8 per shape, 0 for rect and 1 for polygon
+    id ends    uint32 per shape, end offset of the id in the id blob
+    coord ends uint32 per shape, end offset of the coordinates
+    ids        utf-8 blob, padded to 8 bytes
+    coords     float64 per coordinate
+
+Touch areas come first, followed by the segments.
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from typing import List, Optional
+
+from layout import DEFAULT_TOLERANCE, Layout, Shape, load_layout
+
+MAGIC = b"LCDL"
+FORMAT_VERSION = 3
+CACHE_DIR_NAME = "__lcdcache__"
+
+_HEADER = struct.Struct("<4sHHIIIIII")
+_KINDS = ("rect", "polygon")
+
+
+def _padding(size: int) -> int:
+    return -size % 8
+
+
+def compile_layout(layout: Layout) -> bytes:
+    """Pack the geometry of a layout in the compiled layout format."""
+    if array("d").itemsize != 8 or array("I").itemsize != 4:
+        raise RuntimeError("Compiled layouts need 4 byte uint32 and 8 byte doubles")
+    shapes = list(layout.touches) + list(layout.segments)
+    kinds = array("B", (_KINDS.index(shape.kind) for shape in shapes))
+    ids = [shape.id.encode() for shape in shapes]
+    id_ends, coord_ends = array("I"), array("I")
+    coords = array("d")
+    id_end = 0
+    for shape, shape_id in zip(shapes, ids):
+        id_end += len(shape_id)
+        id_ends.append(id_end)
+        coords.extend(shape.coords)
+        coord_ends.append(len(coords))
+    id_blob = b"".join(ids)
+
+    parts = [
+        _HEADER.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            0,
+            layout.width,
+            layout.height,
+            len(layout.touches),
+            len(layout.segments),
+            len(id_blob),
+            len(coords),
+        ),
+        kinds.tobytes(),
+        id_ends.tobytes(),
+        coord_ends.tobytes(),
+        id_blob,
+    ]
+    # Align the coordinates so they can be cast in place
+    parts.append(bytes(_padding(sum(map(len, parts)))))
+    parts.append(coords.tobytes())
+    return b"".join(parts)
+
+
+def _check_ends(ends, total: int) -> None:
+    previous = 0
+    for end in ends:
+        if end < previous:
+            raise ValueError("Corrupt compiled layout")
+        previous = end
+    if previous != total:
+        raise ValueError("Corrupt compiled layout")
+
+
+def read_compiled(buffer) -> Layout:
+    """Get the layout from a buffer in the compiled layout format.
+
+    Raises ValueError for a buffer that is not a valid compiled layout.
+    """
+    if len(buffer) < _HEADER.size:
+        raise ValueError("Not a compiled layout")
+    (
+        magic,
+        version,
+        _,
+        width,
+        height,
+        touch_count,
+        segment_count,
+        id_blob_size,
+        coord_count,
+    ) = _HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a compiled layout of a supported version")
+
+    coords_offset = _HEADER.size + 9 * (touch_count + segment_count) + id_blob_size
+    coords_offset += _padding(coords_offset)
+    if len(buffer) != coords_offset + 8 * coord_count:
+        raise ValueError("Truncated compiled layout")
+
+    view = memoryview(buffer)
+    views = [view]
+    # Views on an mmap are released however decoding ends, so it can be closed
+    try:
+        shape_count = touch_count + segment_count
+        offset = _HEADER.size
+        kinds = view[offset : offset + shape_count]
+        offset += shape_count
+        id_ends = view[offset : offset + 4 * shape_count].cast("I")
+        offset += 4 * shape_count
+        coord_ends = view[offset : offset + 4 * shape_count].cast("I")
+        offset += 4 * shape_count
+        id_blob = bytes(view[offset : offset + id_blob_size])
+        coords = view[coords_offset:].cast("d")
+        views = [kinds, id_ends, coord_ends, coords, view]
+
+        if any(kind >= len(_KINDS) for kind in kinds):
+            raise ValueError("Unknown shape kind in compiled layout")
+        _check_ends(id_ends, id_blob_size)
+        _check_ends(coord_ends, coord_count)
+
+        shapes: List[Shape] = []
+        id_start = coord_start = 0
+        for kind, id_end, coord_end in zip(kinds, id_ends, coord_ends):
+            shapes.append(
+                Shape(
+                    id_blob[id_start:id_end].decode(),
+                    _KINDS[kind],
+                    tuple(coords[coord_start:coord_end]),
+                )
+            )
+            id_start, coord_start = id_end, coord_end
+    finally:
+        for part in views:
+            part.release()
+
+    return Layout(width, height, shapes[:touch_count], shapes[touch_count:])
+
+
+def cache_path(
+    svg_path: str,
+    svg_content: bytes,
+    touch_class: Optional[str] = None,
+    segment_class: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> str:
+    """Get the path of the compiled layout for an svg with given loader options."""
+    digest = hashlib.sha256(svg_content)
+    digest.update(
+        repr((FORMAT_VERSION, touch_class, segment_class, tolerance)).encode()
+    )
+    name = os.path.splitext(os.path.basename(svg_path))[0]
+    cache_dir = cache_dir or os.path.join(os.path.dirname(svg_path), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, f"{name}-{digest.hexdigest()[:16]}.lcdl")
+
+
+def load_layout_cached(
+    svg_path: str,
+    touch_class: Optional[str] = None,
+    segment_class: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> Layout:
+    """Load a layout from its compiled cache, compiling the svg on a cache miss.
+
+    When the cache can't be written the layout is still loaded from the svg.
+    """
+    with open(svg_path, "rb") as svg_file:
+        svg_content = svg_file.read()
+    compiled_path = cache_path(
+        svg_path, svg_content, touch_class, segment_class, cache_dir, tolerance
+    )
+
+    try:
+        with open(compiled_path, "rb") as compiled_file, mmap.mmap(
+            compiled_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as compiled:
+            return read_compiled(compiled)
+    except (OSError, ValueError):
+        pass
+
+    layout = load_layout(svg_path, touch_class, segment_class, tolerance)
+    try:
+        os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+        temporary_path = f"{compiled_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as compiled_file:
+            compiled_file.write(compile_layout(layout))
+        os.replace(temporary_path, compiled_path)
+    except OSError as error:
+        print(f"Could not cache compiled layout: {error}")
+    return layout
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile layout svgs ahead of time.")
+    parser.add_argument("svg", nargs="+")
+    parser.add_argument("--touch-class")
+    parser.add_argument("--segment-class")
+    parser.add_argument("--cache-dir")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    for svg in args.svg:
+        load_layout_cached(
+            svg, args.touch_class, args.segment_class, args.cache_dir, args.tolerance
+        )
@@ -0,0 +1,480 @@
+"""Clients for talking to a custom LCD simulator.
+
+Only depends on pyzmq and `lcd_protocol`, so importing it does not pull in Tk or
+the svg parsing of the simulator.
+"""
+import asyncio
+import itertools
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import zmq
+import zmq.asyncio
+
+from lcd_protocol import (  # noqa: F401 re-exported for the clients
+    DEFAULT_CONNECT_ENDPOINT,
+    DEFAULT_INTERRUPT_CONNECT_ENDPOINT,
+    I2C_LCD_ADDRESS,
+    I2C_LCD_BATCH_CMD,
+    I2C_LCD_CLEAR_MASK_CMD,
+    I2C_LCD_READ_CMD,
+    I2C_LCD_SET_MASK_CMD,
+    I2C_LCD_WRITE_ALL_CMD,
+    I2C_LCD_WRITE_ELEMENTS_CMD,
+    I2C_LCD_WRITE_RANGE_CMD,
+    I2C_LCD_WRITE_SINGLE_CMD,
+    I2C_TOUCH_ADDRESS,
+    I2C_TOUCH_READ_CMD,
+    ILLEGAL_PREFIX,
+    TOUCH_INTERRUPT_TOPIC,
+    TouchEvent,
+    bit_mask,
+    elements_request,
+    pack_bits,
+    pack_elements,
+    range_operation,
+    set_bits,
+    touch_events_request,
+    unpack_touch_events,
+)
+
+# Touch events are polled at this interval without an interrupt endpoint
+POLL_INTERVAL = 0.02
+# Interrupts are published without delivery guarantee, so check now and then
+INTERRUPT_RECHECK_INTERVAL = 1.0
+
+
+class ProtocolError(Exception):
+    """The simulator rejected a request."""
+
+
+def _check(message: bytes, reply: bytes) -> bytes:
+    if reply.startswith(ILLEGAL_PREFIX):
+        raise ProtocolError(f"Simulator rejected request {message.hex()}")
+    return reply
+
+
+def _bit_message(address: int, index: int, value: Optional[bool]) -> bytes:
+    if value is None:
+        return bytes((address, I2C_LCD_WRITE_SINGLE_CMD, 0, index))
+    command = I2C_LCD_SET_MASK_CMD if value else I2C_LCD_CLEAR_MASK_CMD
+    return bytes((address,)) + range_operation(command, *bit_mask(index))
+
+
+def _batch_message(address: int, operations: Iterable[Tuple[int, int, bytes]]) -> bytes:
+    return bytes((address, I2C_LCD_BATCH_CMD)) + b"".join(
+        range_operation(command, offset, data) for command, offset, data in operations
+    )
+
+
+class PipelinedClient:
+    """DEALER client keeping up to `window` requests in flight.
+
+    Each request is sent as a correlation id frame, an empty delimiter frame and
+    the message, replies are matched on the correlation id. This works with both
+    the default REP socket of the simulator and its ROUTER socket (`--router`),
+    the latter serves several clients at once.
+
+    When no reply arrives within `timeout` seconds the socket is reconnected,
+    dropping anything still queued for a dead simulator, and `TimeoutError` is
+    raised. `request` then resends up to `retries` times.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = DEFAULT_CONNECT_ENDPOINT,
+        window: int = 16,
+        context: Optional[zmq.Context] = None,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+    ):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.endpoint = endpoint
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self._context = context or zmq.Context.instance()
+        self._ids = itertools.count()
+        self._in_flight = set()
+        self._replies: Dict[int, bytes] = {}
+        self.socket = None
+        self.reconnect()
+
+    def reconnect(self) -> None:
+        """Replace the socket with a fresh one, requests in flight are dropped."""
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = self._context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.endpoint)
+        self._in_flight.clear()
+        self._replies.clear()
+
+    def send(self, message: bytes) -> int:
+        """Send a request and get its correlation id, blocks while the window is full."""
+        while len(self._in_flight) >= self.window:
+            self._receive_one(self.timeout)
+        correlation_id = next(self._ids) & 0xFFFFFFFF
+        self.socket.send_multipart([correlation_id.to_bytes(4, "big"), b"", message])
+        self._in_flight.add(correlation_id)
+        return correlation_id
+
+    def reply(self, correlation_id: int) -> bytes:
+        """Wait for the reply of a request sent earlier."""
+        while correlation_id not in self._replies:
+            if correlation_id not in self._in_flight:
+                raise KeyError(f"No request with correlation id {correlation_id}")
+            self._receive_one(self.timeout)
+        return self._replies.pop(correlation_id)
+
+    def request(self, message: bytes, retries: Optional[int] = None) -> bytes:
+        """Send a single request and wait for its reply, resending on timeouts."""
+        retries = self.retries if retries is None else retries
+        while True:
+            try:
+                return self.reply(self.send(message))
+            except TimeoutError:
+                if retries <= 0:
+                    raise
+                retries -= 1
+
+    def request_all(self, messages: Iterable[bytes]) -> List[bytes]:
+        """Send all messages pipelined and get the replies in the same order."""
+        correlation_ids = [self.send(message) for message in messages]
+        return [self.reply(correlation_id) for correlation_id in correlation_ids]
+
+    def close(self) -> None:
+        """Close the socket, replies still in flight are lost."""
+        self.socket.close()
+
+    def _receive_one(self, timeout: Optional[float]) -> None:
+        if timeout is not None and not self.socket.poll(timeout * 1000):
+            self.reconnect()
+            raise TimeoutError(f"No reply from {self.endpoint} within {timeout} s")
+        correlation_id, _, reply = self.socket.recv_multipart()
+        correlation_id = int.from_bytes(correlation_id, "big")
+        # Late replies of requests dropped by a reconnect are ignored
+        if correlation_id in self._in_flight:
+            self._in_flight.discard(correlation_id)
+            self._replies[correlation_id] = reply
+
+
+class LcdClient(PipelinedClient):
+    """Typed calls to the touch controller and LCD of a simulator.
+
+    Writes that toggle are never resent, as a lost reply does not mean a lost
+    request. With an `interrupt_endpoint` `wait_touch_events` sleeps until the
+    simulator announces a touch event, otherwise it polls.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = DEFAULT_CONNECT_ENDPOINT,
+        lcd_address: int = I2C_LCD_ADDRESS,
+        touch_address: int = I2C_TOUCH_ADDRESS,
+        interrupt_endpoint: Optional[str] = None,
+        bits_per_element: int = 1,
+        **kwargs,
+    ):
+        super().__init__(endpoint, **kwargs)
+        self.lcd_address = lcd_address
+        self.bits_per_element = bits_per_element
+        self.touch_address = touch_address
+        self.next_event_sequence: Optional[int] = None
+        self.interrupt_socket = None
+        if interrupt_endpoint:
+            self.interrupt_socket = self._context.socket(zmq.SUB)
+            self.interrupt_socket.setsockopt(zmq.LINGER, 0)
+            self.interrupt_socket.setsockopt(zmq.SUBSCRIBE, TOUCH_INTERRUPT_TOPIC)
+            self.interrupt_socket.connect(interrupt_endpoint)
+
+    def read_touch(self) -> bytes:
+        """Get the touch RAM, the controller clears it on every read."""
+        return self._call(bytes((self.touch_address, I2C_TOUCH_READ_CMD)))
+
+    def read_touched(self) -> List[int]:
+        """Get the indices of the surfaces touched since the last read."""
+        return set_bits(self.read_touch())
+
+    def read_touch_events(self) -> List[TouchEvent]:
+        """Get the touch events since the last call, the first call starts recording.
+
+        A gap in the sequence numbers means events were pushed out of the ring
+        buffer of the simulator before they were read.
+        """
+        message = touch_events_request(self.touch_address, self.next_event_sequence)
+        self.next_event_sequence, events = unpack_touch_events(self._call(message))
+        return events
+
+    def wait_touch_events(self, timeout: Optional[float] = None) -> List[TouchEvent]:
+        """Sleep until there are touch events and get all of them, [] on timeout."""
+        if self.next_event_sequence is None:
+            self.read_touch_events()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events = self.read_touch_events()
+            if events:
+                return events
+            wait = POLL_INTERVAL
+            if self.interrupt_socket is not None:
+                wait = INTERRUPT_RECHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return []
+            if self.interrupt_socket is None:
+                time.sleep(wait)
+            elif self.interrupt_socket.poll(wait * 1000):
+                # A single read gets the events of all pending interrupts
+                while self.interrupt_socket.poll(0):
+                    self.interrupt_socket.recv_multipart()
+
+    def read_display(self) -> bytes:
+        """Get the display RAM."""
+        return self._call(bytes((self.lcd_address, I2C_LCD_READ_CMD)))
+
+    def write_all(self, data: bytes) -> None:
+        """Overwrite the display RAM."""
+        self._call(bytes((self.lcd_address, I2C_LCD_WRITE_ALL_CMD)) + bytes(data))
+
+    def write_range(self, offset: int, data: bytes) -> None:
+        """Overwrite the display RAM from byte `offset` on."""
+        self._range(I2C_LCD_WRITE_RANGE_CMD, offset, data)
+
+    def set_mask(self, offset: int, mask: bytes) -> None:
+        """Light the segments of `mask`, which starts at byte `offset`."""
+        self._range(I2C_LCD_SET_MASK_CMD, offset, mask)
+
+    def clear_mask(self, offset: int, mask: bytes) -> None:
+        """Turn off the segments of `mask`, which starts at byte `offset`."""
+        self._range(I2C_LCD_CLEAR_MASK_CMD, offset, mask)
+
+    def write_batch(self, operations: Iterable[Tuple[int, int, bytes]]) -> None:
+        """Apply command, offset and data range operations as one redraw."""
+        self._call(_batch_message(self.lcd_address, operations))
+
+    def write_elements(self, first: int, values: Iterable[int]) -> None:
+        """Set the values of consecutive segments from `first` on, for displays
+        of `bits_per_element` bits per segment."""
+        self._call(
+            elements_request(self.lcd_address, first, values, self.bits_per_element)
+        )
+
+    def write_bit(self, index: int, value: Optional[bool] = None) -> None:
+        """Light or turn off a single segment, or toggle it without a value.
+
+        Toggles are never resent.
+        """
+        message = _bit_message(self.lcd_address, index, value)
+        self._call(message, retries=0 if value is None else None)
+
+    def close(self) -> None:
+        """Close the sockets, replies still in flight are lost."""
+        super().close()
+        if self.interrupt_socket is not None:
+            self.interrupt_socket.close()
+
+    def _range(self, command: int, offset: int, data: bytes) -> None:
+        self._call(bytes((self.lcd_address,)) + range_operation(command, offset, data))
+
+    def _call(self, message: bytes, retries: Optional[int] = None) -> bytes:
+        return _check(message, self.request(message, retries))
+
+
+class AsyncLcdClient:
+    """Asyncio flavour of `LcdClient`, on a `zmq.asyncio` DEALER socket.
+
+    Any number of coroutines can await requests concurrently, at most `window`
+    of them are in flight at once. A background task matches the replies to the
+    waiting requests by correlation id. Create it inside the running event loop.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = DEFAULT_CONNECT_ENDPOINT,
+        window: int = 16,
+        context: Optional[zmq.asyncio.Context] = None,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+        lcd_address: int = I2C_LCD_ADDRESS,
+        touch_address: int = I2C_TOUCH_ADDRESS,
+        interrupt_endpoint: Optional[str] = None,
+        bits_per_element: int = 1,
+    ):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.retries = retries
+        self.lcd_address = lcd_address
+        self.bits_per_element = bits_per_element
+        self.touch_address = touch_address
+        self._context = context or zmq.asyncio.Context.instance()
+        self._window = asyncio.Semaphore(window)
+        self._ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._receiver: Optional[asyncio.Future] = None
+        self.next_event_sequence: Optional[int] = None
+        self.interrupt_socket = None
+        if interrupt_endpoint:
+            self.interrupt_socket = self._context.socket(zmq.SUB)
+            self.interrupt_socket.setsockopt(zmq.LINGER, 0)
+            self.interrupt_socket.setsockopt(zmq.SUBSCRIBE, TOUCH_INTERRUPT_TOPIC)
+            self.interrupt_socket.connect(interrupt_endpoint)
+        self.socket = None
+        self.reconnect()
+
+    def reconnect(self) -> None:
+        """Replace the socket with a fresh one, requests in flight time out."""
+        self._close_socket()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(TimeoutError("Request dropped by a reconnect"))
+        self._pending.clear()
+        self.socket = self._context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.endpoint)
+
+    async def request(self, message: bytes, retries: Optional[int] = None) -> bytes:
+        """Send a single request and wait for its reply, resending on timeouts."""
+        retries = self.retries if retries is None else retries
+        while True:
+            socket = self.socket
+            try:
+                return await self._request_once(message)
+            except (asyncio.TimeoutError, TimeoutError):
+                # Concurrent requests timing out together reconnect only once
+                if socket is self.socket:
+                    self.reconnect()
+                if retries <= 0:
+                    raise TimeoutError(
+                        f"No reply from {self.endpoint} within {self.timeout} s"
+                    ) from None
+                retries -= 1
+
+    async def request_all(self, messages: Iterable[bytes]) -> List[bytes]:
+        """Send all messages pipelined and get the replies in the same order."""
+        return list(await asyncio.gather(*map(self.request, messages)))
+
+    async def read_touch(self) -> bytes:
+        """Get the touch RAM, the controller clears it on every read."""
+        return await self._call(bytes((self.touch_address, I2C_TOUCH_READ_CMD)))
+
+    async def read_touched(self) -> List[int]:
+        """Get the indices of the surfaces touched since the last read."""
+        return set_bits(await self.read_touch())
+
+    async def read_touch_events(self) -> List[TouchEvent]:
+        """Get the touch events since the last call, the first call starts recording."""
+        message = touch_events_request(self.touch_address, self.next_event_sequence)
+        reply = await self._call(message)
+        self.next_event_sequence, events = unpack_touch_events(reply)
+        return events
+
+    async def wait_touch_events(
+        self, timeout: Optional[float] = None
+    ) -> List[TouchEvent]:
+        """Sleep until there are touch events and get all of them, [] on timeout."""
+        if self.next_event_sequence is None:
+            await self.read_touch_events()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events = await self.read_touch_events()
+            if events:
+                return events
+            wait = POLL_INTERVAL
+            if self.interrupt_socket is not None:
+                wait = INTERRUPT_RECHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return []
+            if self.interrupt_socket is None:
+                await asyncio.sleep(wait)
+            elif await self.interrupt_socket.poll(wait * 1000):
+                # A single read gets the events of all pending interrupts
+                while await self.interrupt_socket.poll(0):
+                    await self.interrupt_socket.recv_multipart()
+
+    async def read_display(self) -> bytes:
+        """Get the display RAM."""
+        return await self._call(bytes((self.lcd_address, I2C_LCD_READ_CMD)))
+
+    async def write_all(self, data: bytes) -> None:
+        """Overwrite the display RAM."""
+        message = bytes((self.lcd_address, I2C_LCD_WRITE_ALL_CMD)) + bytes(data)
+        await self._call(message)
+
+    async def write_range(self, offset: int, data: bytes) -> None:
+        """Overwrite the display RAM from byte `offset` on."""
+        await self._range(I2C_LCD_WRITE_RANGE_CMD, offset, data)
+
+    async def set_mask(self, offset: int, mask: bytes) -> None:
+        """Light the segments of `mask`, which starts at byte `offset`."""
+        await self._range(I2C_LCD_SET_MASK_CMD, offset, mask)
+
+    async def clear_mask(self, offset: int, mask: bytes) -> None:
+        """Turn off the segments of `mask`, which starts at byte `offset`."""
+        await self._range(I2C_LCD_CLEAR_MASK_CMD, offset, mask)
+
+    async def write_batch(self, operations: Iterable[Tuple[int, int, bytes]]) -> None:
+        """Apply command, offset and data range operations as one redraw."""
+        await self._call(_batch_message(self.lcd_address, operations))
+
+    async def write_elements(self, first: int, values: Iterable[int]) -> None:
+        """Set the values of consecutive segments from `first` on, for displays
+        of `bits_per_element` bits per segment."""
+        await self._call(
+            elements_request(self.lcd_address, first, values, self.bits_per_element)
+        )
+
+    async def write_bit(self, index: int, value: Optional[bool] = None) -> None:
+        """Light or turn off a single segment, or toggle it without a value.
+
+        Toggles are never resent.
+        """
+        message = _bit_message(self.lcd_address, index, value)
+        await self._call(message, retries=0 if value is None else None)
+
+    def close(self) -> None:
+        """Stop receiving and close the sockets, replies still in flight are lost."""
+        self._close_socket()
+        if self.interrupt_socket is not None:
+            self.interrupt_socket.close()
+
+    def _close_socket(self) -> None:
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self.socket is not None:
+            self.socket.close()
+
+    async def _range(self, command: int, offset: int, data: bytes) -> None:
+        message = bytes((self.lcd_address,)) + range_operation(command, offset, data)
+        await self._call(message)
+
+    async def _call(self, message: bytes, retries: Optional[int] = None) -> bytes:
+        return _check(message, await self.request(message, retries))
+
+    async def _request_once(self, message: bytes) -> bytes:
+        async with self._window:
+            correlation_id = next(self._ids) & 0xFFFFFFFF
+            future = asyncio.get_running_loop().create_future()
+            self._pending[correlation_id] = future
+            if self._receiver is None:
+                self._receiver = asyncio.ensure_future(self._receive(self.socket))
+            try:
+                await self.socket.send_multipart(
+                    [correlation_id.to_bytes(4, "big"), b"", message]
+                )
+                return await asyncio.wait_for(future, self.timeout)
+            finally:
+                self._pending.pop(correlation_id, None)
+
+    async def _receive(self, socket: zmq.asyncio.Socket) -> None:
+        while True:
+            correlation_id, _, reply = await socket.recv_multipart()
+            future = self._pending.get(int.from_bytes(correlation_id, "big"))
+            if future is not None and not future.done():
+                future.set_result(reply)
@@ -0,0 +1,943 @@
+"""Headless core of the custom LCD simulator.
+
+Owns the display and touch state and serves the I2C-like protocol over ZeroMQ.
+Views, like the Tk based `custom_lcd.CustomLCD`, subscribe to display changes.
+Run it to serve the simulator headless, without Tk:
+
+    python lcd_core.py --mask Masked.svg --device lcd:0x34:Status.svg
+"""
+import argparse
+import contextlib
+import functools
+import itertools
+import threading
+import time
+from collections import deque
+from socket import socketpair
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from xml.sax.saxutils import quoteattr
+
+import zmq
+
+from lcd_protocol import (  # noqa: F401 re-exported for the views
+    DEFAULT_DOORBELL_ENDPOINT,
+    DEFAULT_ENDPOINT,
+    DEFAULT_INTERRUPT_ENDPOINT,
+    I2C_LCD_ADDRESS,
+    I2C_LCD_BATCH_CMD,
+    I2C_LCD_CLEAR_MASK_CMD,
+    I2C_LCD_READ_CMD,
+    I2C_LCD_SET_MASK_CMD,
+    I2C_LCD_SNAPSHOT_CMD,
+    I2C_LCD_SNAPSHOT_PNG_CMD,
+    I2C_LCD_WRITE_ALL_CMD,
+    I2C_LCD_WRITE_ELEMENTS_CMD,
+    I2C_LCD_WRITE_RANGE_CMD,
+    I2C_LCD_WRITE_SINGLE_CMD,
+    I2C_SIM_ADDRESS,
+    I2C_SIM_STATS_CMD,
+    I2C_TOUCH_ADDRESS,
+    I2C_TOUCH_READ_CMD,
+    I2C_TOUCH_READ_EVENTS_CMD,
+    ELEMENTS,
+    ILLEGAL_PREFIX,
+    RANGE,
+    SEQUENCE,
+    TOUCH_EVENT,
+    TOUCH_INTERRUPT_TOPIC,
+    TouchEvent,
+)
+from bus_timing import BUS_SPEEDS, BusProfiler, I2cBusModel
+from layout_cache import load_layout_cached
+from lcd_stats import SimulatorStats
+from palette import PALETTE_KINDS, PaletteSpec, hex_color, make_palette
+from ram_memory import PackedMemory, RamMemory
+from shared_ram import SharedRam
+from spatial_index import ShapeIndex
+from traffic_log import REPLY, REQUEST, TrafficRecorder
+
+try:
+    from raster import RasterRenderer
+except ImportError:  # numpy is optional, only needed for png snapshots
+    RasterRenderer = None
+
+RATE_REPORT_INTERVAL_MS = 5000
+# Frames per second the display is rendered at most, like a real LCD refresh
+DEFAULT_REFRESH_RATE = 60
+TOUCH_EVENT_CAPACITY = 1024
+
+SNAPSHOT_ON_FILL = "black"
+SNAPSHOT_BACKGROUND = "white"
+
+
+Handler = Callable[[bytes], Optional[bytes]]
+
+
+class Device:
+    """Peripheral on the simulated bus.
+
+    Subclasses fill `handlers` with a handler per command byte, a handler gets the
+    whole message and returns the reply.
+    """
+
+    def __init__(self, address: int):
+        self.address = address
+        self.handlers: Dict[int, Handler] = {}
+
+    def process_message(self, message: bytes) -> Optional[bytes]:
+        """Process a message addressed to this device, None for unknown commands."""
+        handler = self.handlers.get(message[1]) if len(message) > 1 else None
+        return handler(message) if handler else None
+
+
+def _monotonic_us() -> int:
+    return time.monotonic_ns() // 1000
+
+
+class TouchEventBuffer:
+    """Ring buffer of the latest packed touch events, numbered by a running sequence.
+
+    Readers keep the sequence of the next event they expect, so they get every
+    event as long as they read before `capacity` newer ones pushed it out.
+    """
+
+    def __init__(self, capacity: int = TOUCH_EVENT_CAPACITY):
+        self._events: Deque[bytes] = deque(maxlen=capacity)
+        self.next_sequence = 0
+        # Microsecond timestamp source, replaced by simulations on virtual time
+        self.clock: Callable[[], int] = _monotonic_us
+
+    def append(
+        self, index: int, pressed: bool, timestamp_us: Optional[int] = None
+    ) -> TouchEvent:
+        """Add an event, timestamped now unless given, and get it."""
+        if timestamp_us is None:
+            timestamp_us = self.clock()
+        event = TouchEvent(self.next_sequence, timestamp_us, index, pressed)
+        self._events.append(TOUCH_EVENT.pack(*event))
+        self.next_sequence = (self.next_sequence + 1) & 0xFFFFFFFF
+        return event
+
+    def since(self, sequence: int) -> bytes:
+        """Get the packed events from `sequence` on, or all buffered ones if older."""
+        # Wrapping distance back from the next sequence
+        behind = (self.next_sequence - sequence) & 0xFFFFFFFF
+        if behind > len(self._events):
+            behind = len(self._events)
+        return b"".join(
+            itertools.islice(self._events, len(self._events) - behind, None)
+        )
+
+
+class TouchDevice(Device):
+    """Touch controller, latches touched surfaces until they are read.
+
+    Every press and release is also recorded in `events` and passed to the
+    subscribers, which emulates the interrupt line of the controller.
+    """
+
+    def __init__(
+        self,
+        layout,
+        address: int = I2C_TOUCH_ADDRESS,
+        event_capacity: int = TOUCH_EVENT_CAPACITY,
+        memory: Optional[RamMemory] = None,
+    ):
+        super().__init__(address)
+        self.handlers[I2C_TOUCH_READ_CMD] = self.read
+        self.handlers[I2C_TOUCH_READ_EVENTS_CMD] = self.read_events
+        self.touches = layout.touches
+        self.touch_state = RamMemory(len(self.touches)) if memory is None else memory
+        self.index = ShapeIndex(self.touches)
+        self.events = TouchEventBuffer(event_capacity)
+        # Surfaces pressed and not released yet
+        self.contacts: Set[int] = set()
+        self._subscribers: List[Callable[[TouchEvent], None]] = []
+
+    def subscribe(self, callback: Callable[[TouchEvent], None]) -> None:
+        """Call `callback` with every touch event."""
+        self._subscribers.append(callback)
+
+    def press(self, idx: int, timestamp_us: Optional[int] = None) -> None:
+        """Mark a touch surface as touched."""
+        self.touch_state.set_bit(idx)
+        if idx not in self.contacts:
+            self.contacts.add(idx)
+            self._record(idx, True, timestamp_us)
+
+    def release(self, idx: int, timestamp_us: Optional[int] = None) -> None:
+        """Lift the touch of a surface."""
+        if idx in self.contacts:
+            self.contacts.remove(idx)
+            self._record(idx, False, timestamp_us)
+
+    def release_all(self) -> None:
+        """Lift all touches."""
+        for idx in sorted(self.contacts):
+            self.release(idx)
+
+    def press_at(self, x: float, y: float) -> List[int]:
+        """Mark all touch surfaces containing the point as touched and get them."""
+        hits = self.index.query(x, y)
+        for idx in hits:
+            self.press(idx)
+        return hits
+
+    def press_points(self, points: Iterable[Tuple[float, float]]) -> List[int]:
+        """Simulate multiple simultaneous touches and get the touched surfaces."""
+        return sorted({idx for x, y in points for idx in self.press_at(x, y)})
+
+    def move_to(self, points: Iterable[Tuple[float, float]]) -> List[int]:
+        """Touch exactly the surfaces under the points and get the newly pressed ones.
+
+        Surfaces no longer under any point are released, like when dragging.
+        """
+        hits = {idx for x, y in points for idx in self.index.query(x, y)}
+        for idx in sorted(self.contacts - hits):
+            self.release(idx)
+        pressed = sorted(hits - self.contacts)
+        for idx in pressed:
+            self.press(idx)
+        return pressed
+
+    def read(self, message: bytes) -> bytes:
+        """Get the touched surfaces and clear them."""
+        reply = self.touch_state.as_bytes()
+        self.touch_state.clear()
+        return reply
+
+    def read_events(self, message: bytes) -> bytes:
+        """Get the next sequence and the events from the sequence in the message."""
+        reply = SEQUENCE.pack(self.events.next_sequence)
+        if len(message) < 2 + SEQUENCE.size:
+            return reply
+        (sequence,) = SEQUENCE.unpack_from(message, 2)
+        return reply + self.events.since(sequence)
+
+    def _record(self, idx: int, pressed: bool, timestamp_us: Optional[int]) -> None:
+        event = self.events.append(idx, pressed, timestamp_us)
+        for callback in self._subscribers:
+            callback(event)
+
+
+class FrameCoalescer:
+    """Collects the display changes between frames, for views that render at a
+    fixed refresh rate instead of on every write."""
+
+    def __init__(self):
+        self.pending: Set[int] = set()
+        self.updates = 0
+        self.frames = 0
+
+    def add(self, changed: Iterable[int]) -> None:
+        """Add the segments changed by a write."""
+        self.pending.update(changed)
+        self.updates += 1
+
+    def take(self) -> Set[int]:
+        """Get the union of the changes since the last frame and start a new one."""
+        changed, self.pending = self.pending, set()
+        self.frames += 1
+        return changed
+
+    @property
+    def coalesced(self) -> int:
+        """Get the number of updates that did not need a frame of their own."""
+        return self.updates - self.frames
+
+
+class ThreadedFrameCoalescer(FrameCoalescer):
+    """Frame coalescer for a display written on another thread.
+
+    The writing thread only counts the update and raises the `dirty` flag. The
+    render thread finds the changes by comparing the display RAM with a copy of
+    what it rendered last, so neither thread ever waits for the other and a
+    burst of writes costs the render thread a single comparison.
+    """
+
+    def __init__(self, display: RamMemory):
+        super().__init__()
+        self.display = display
+        self.dirty = False
+        self._rendered = display.copy()
+
+    def add(self, changed: Iterable[int]) -> None:
+        """Flag the display as changed, called on the writing thread."""
+        self.updates += 1
+        self.dirty = True
+
+    def take(self) -> Set[int]:
+        """Get the changes since the last frame, called on the render thread."""
+        # Lowered before the copy, a write during the copy raises it again
+        self.dirty = False
+        self.frames += 1
+        return self._rendered.write_from_bytes(self.display.as_bytes())
+
+
+class LcdDevice(Device):
+    """LCD controller, owns the display RAM and notifies subscribers of changes.
+
+    Segments have `bits_per_element` bits each, for grayscale or colour, packed
+    in the display RAM. Snapshots draw the values with `palette`, a kind of
+    `palette.make_palette` or a list of colors, by default a gray scale.
+    """
+
+    def __init__(
+        self,
+        layout,
+        address: int = I2C_LCD_ADDRESS,
+        memory: Optional[RamMemory] = None,
+        bits_per_element: int = 1,
+        palette: Optional[PaletteSpec] = None,
+    ):
+        super().__init__(address)
+        self.handlers.update(
+            {
+                I2C_LCD_READ_CMD: self.read,
+                I2C_LCD_WRITE_ALL_CMD: self.write_all,
+                I2C_LCD_WRITE_SINGLE_CMD: self.write_single,
+                I2C_LCD_WRITE_RANGE_CMD: self.write_range,
+                I2C_LCD_SET_MASK_CMD: self.write_range,
+                I2C_LCD_CLEAR_MASK_CMD: self.write_range,
+                I2C_LCD_BATCH_CMD: self.write_batch,
+                I2C_LCD_WRITE_ELEMENTS_CMD: self.write_elements,
+                I2C_LCD_SNAPSHOT_CMD: self.snapshot,
+                I2C_LCD_SNAPSHOT_PNG_CMD: self.snapshot_png_message,
+            }
+        )
+        self.layout = layout
+        if memory is not None:
+            self.display_state = memory
+        elif bits_per_element == 1:
+            self.display_state = RamMemory(len(layout.segments))
+        else:
+            self.display_state = PackedMemory(len(layout.segments), bits_per_element)
+        self.palette = make_palette(
+            palette or "gray", bits_per_element, SNAPSHOT_ON_FILL, SNAPSHOT_BACKGROUND
+        )
+        # RAM operation of each command usable in a batch
+        self.range_operations = {
+            I2C_LCD_WRITE_RANGE_CMD: self.display_state.write_range,
+            I2C_LCD_SET_MASK_CMD: self.display_state.set_mask,
+            I2C_LCD_CLEAR_MASK_CMD: self.display_state.clear_mask,
+        }
+        self._subscribers: List[Callable[[Iterable[int]], None]] = []
+        # Raster renderer for png snapshots, shared with a raster view if any
+        self.renderer = None
+        self.redraw_latency = None
+
+    def subscribe(self, callback: Callable[[Iterable[int]], None]) -> None:
+        """Call `callback` with the indices of the changed segments on each change."""
+        self._subscribers.append(callback)
+
+    def notify(self, changed: Iterable[int]) -> None:
+        """Let all subscribers know which segments changed."""
+        if not changed:
+            return
+        if self.redraw_latency is None:
+            for callback in self._subscribers:
+                callback(changed)
+            return
+        start = time.perf_counter()
+        for callback in self._subscribers:
+            callback(changed)
+        if self._subscribers:
+            self.redraw_latency.add(time.perf_counter() - start)
+
+    def read(self, message: bytes) -> bytes:
+        """Get the display RAM."""
+        return self.display_state.as_bytes()
+
+    def write_all(self, message: bytes) -> bytes:
+        """Overwrite the display RAM with the message payload."""
+        self.notify(self.display_state.write_from_bytes(message[2:]))
+        return bytes((self.address, I2C_LCD_WRITE_ALL_CMD))
+
+    def write_single(self, message: bytes) -> Optional[bytes]:
+        """Toggle the segment in the fourth byte of the message.
+
+        The third byte is ignored, it is kept for compatibility with existing
+        clients. Use the mask commands to set or clear a segment instead.
+        Illegal when the message is malformed or the bit outside the display.
+        """
+        display = self.display_state
+        if len(message) != 4 or message[3] >= len(display) * display.bits_per_element:
+            return None
+        display.toggle_bit(message[3])
+        self.notify((message[3] // self.display_state.bits_per_element,))
+        return bytes((self.address, I2C_LCD_WRITE_SINGLE_CMD))
+
+    def write_range(self, message: bytes) -> Optional[bytes]:
+        """Write, set or clear a range of the display RAM in place."""
+        operations = self._parse_operations(message, 1)
+        if operations is None or len(operations) != 1:
+            return None
+        self._apply(operations)
+        return bytes((self.address, message[1]))
+
+    def write_batch(self, message: bytes) -> Optional[bytes]:
+        """Apply all range operations of a batch, redrawing the union of the changes.
+
+        Nothing is applied when any operation is malformed.
+        """
+        operations = self._parse_operations(message, 2)
+        if operations is None:
+            return None
+        self._apply(operations)
+        return bytes((self.address, I2C_LCD_BATCH_CMD))
+
+    def write_elements(self, message: bytes) -> Optional[bytes]:
+        """Write the packed values of consecutive segments from a first one on."""
+        if len(message) < 2 + ELEMENTS.size:
+            return None
+        first, count = ELEMENTS.unpack_from(message, 2)
+        try:
+            changed = self.display_state.write_elements(
+                first, message[2 + ELEMENTS.size :], count
+            )
+        except ValueError:
+            return None
+        self.notify(changed)
+        return bytes((self.address, I2C_LCD_WRITE_ELEMENTS_CMD))
+
+    def _parse_operations(self, message: bytes, position: int) -> Optional[List]:
+        """Get the range operations from `position` to the end, None if malformed."""
+        operations = []
+        while position < len(message):
+            operation = self.range_operations.get(message[position])
+            if operation is None or position + 1 + RANGE.size > len(message):
+                return None
+            offset, length = RANGE.unpack_from(message, position + 1)
+            start = position + 1 + RANGE.size
+            position = start + length
+            if position > len(message):
+                return None
+            operations.append((operation, offset, message[start:position]))
+        return operations
+
+    def _apply(self, operations: List) -> None:
+        changed: Set[int] = set()
+        for operation, offset, payload in operations:
+            changed.update(operation(offset, payload))
+        self.notify(changed)
+
+    def snapshot(self, message: bytes) -> bytes:
+        """Get the display as svg document."""
+        return self.snapshot_svg().encode()
+
+    def snapshot_png_message(self, message: bytes) -> bytes:
+        """Get the display as png image, illegal without numpy."""
+        if self.renderer is None and RasterRenderer is None:
+            return ILLEGAL_PREFIX + message
+        return self.snapshot_png()
+
+    def snapshot_png(self) -> bytes:
+        """Render the display as png image, needs numpy."""
+        if self.renderer is None:
+            self.renderer = RasterRenderer(
+                self.layout, background=SNAPSHOT_BACKGROUND, palette=self.palette
+            )
+        return self.renderer.render_png(self.display_state)
+
+    def snapshot_svg(self) -> str:
+        """Render the segments that are not off as svg document."""
+        width, height = self.layout.width, self.layout.height
+        elements = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+            f'<rect width="100%" height="100%" fill="{SNAPSHOT_BACKGROUND}"/>',
+        ]
+        for (_, value), segment in zip(
+            self.display_state.iterate_elements(), self.layout.segments
+        ):
+            if not value:
+                continue
+            if segment.kind == "rect":
+                x1, y1, x2, y2 = segment.coords
+                geometry = (
+                    f'<rect x="{x1}" y="{y1}" width="{x2 - x1}" height="{y2 - y1}"'
+                )
+            else:
+                points = " ".join(map(str, segment.coords))
+                geometry = f'<polygon points="{points}"'
+            fill = hex_color(self.palette[value])
+            elements.append(f'{geometry} id={quoteattr(segment.id)} fill="{fill}"/>')
+        elements.append("</svg>")
+        return "\n".join(elements)
+
+
+class DiagnosticsDevice(Device):
+    """Diagnostics of the simulator itself, not part of any real board."""
+
+    def __init__(self, simulator: "LcdSimulator", address: int = I2C_SIM_ADDRESS):
+        super().__init__(address)
+        self.handlers[I2C_SIM_STATS_CMD] = self.read_stats
+        self.simulator = simulator
+
+    def read_stats(self, message: bytes) -> bytes:
+        """Get the statistics as json, empty when disabled."""
+        stats = self.simulator.stats
+        return stats.to_json() if stats else b"{}"
+
+
+class DeviceBus:
+    """Devices sharing one bus, dispatches messages on their first address byte."""
+
+    def __init__(self, devices: Iterable[Device] = ()):
+        # One slot per possible address byte, so dispatch is a single index
+        self._table: List[Optional[Device]] = [None] * 256
+        for device in devices:
+            self.attach(device)
+
+    def attach(self, device: Device) -> Device:
+        """Add a device to the bus and get it back."""
+        if not 0 <= device.address < len(self._table):
+            raise ValueError(f"Address {device.address} does not fit in a byte")
+        if self._table[device.address] is not None:
+            raise ValueError(f"Address 0x{device.address:02x} is already in use")
+        self._table[device.address] = device
+        return device
+
+    def detach(self, address: int) -> Device:
+        """Remove the device at an address from the bus and get it."""
+        device = self[address]
+        self._table[address] = None
+        return device
+
+    def __contains__(self, address: int) -> bool:
+        """Get whether a device has the address."""
+        return 0 <= address < len(self._table) and self._table[address] is not None
+
+    def __getitem__(self, address: int) -> Device:
+        device = self._table[address]
+        if device is None:
+            raise KeyError(f"No device at address 0x{address:02x}")
+        return device
+
+    @property
+    def devices(self) -> Dict[int, Device]:
+        """Get the attached devices by address."""
+        return {
+            address: device
+            for address, device in enumerate(self._table)
+            if device is not None
+        }
+
+    def process_message(self, message: bytes) -> bytes:
+        """Dispatch a message to the addressed device and get its reply.
+
+        A message the device fails on is illegal, so it cannot stop the I/O loop.
+        """
+        device = self._table[message[0]] if message else None
+        try:
+            reply = device.process_message(message) if device else None
+        except Exception as error:
+            print(f"Illegal message {message.hex()}: {error!r}")
+            reply = None
+        return ILLEGAL_PREFIX + message if reply is None else reply
+
+
+# Device kinds that can be built from a layout, by name
+DEVICE_TYPES = {"lcd": LcdDevice, "touch": TouchDevice}
+
+
+class LcdSimulator:
+    """Dispatches the bus messages to the devices and serves them over ZeroMQ.
+
+    The bus holds a touch controller and LCD for `layout` at their default
+    addresses, further `devices` simulate the rest of the board behind the same
+    socket.
+
+    With an `interrupt_endpoint` every touch event is announced on a PUB socket,
+    as topic, touch controller address and event sequence frames. With `record`
+    all requests, replies and touch events are appended to that traffic log.
+
+    With `shared_memory` the display and touch RAM live in a shared memory block
+    of that name, see `shared_ram`, and local clients ring the doorbell PULL
+    socket at `doorbell_endpoint` after writing the display.
+
+    The display of `layout` has `bits_per_element` bits per segment, see
+    `LcdDevice`.
+
+    With a `bus_profiler` every transaction is charged the time it would take
+    on an I2C bus, reported with the statistics.
+
+    `start` serves the sockets on a background I/O thread, so replies never
+    wait for a view. The I/O thread then owns the sockets and the device state,
+    other threads hand it work with `call_soon`.
+    """
+
+    def __init__(
+        self,
+        layout,
+        endpoint: str = DEFAULT_ENDPOINT,
+        router: bool = False,
+        context: Optional[zmq.Context] = None,
+        stats: bool = False,
+        stats_endpoint: Optional[str] = None,
+        devices: Iterable[Device] = (),
+        interrupt_endpoint: Optional[str] = None,
+        record: Optional[str] = None,
+        shared_memory: Optional[str] = None,
+        doorbell_endpoint: str = DEFAULT_DOORBELL_ENDPOINT,
+        bus_profiler: Optional[BusProfiler] = None,
+        bits_per_element: int = 1,
+        palette: Optional[PaletteSpec] = None,
+    ):
+        self.shared = None
+        if shared_memory and bits_per_element != 1:
+            raise ValueError("Shared memory holds displays of 1 bit per segment only")
+        if shared_memory:
+            self.shared = SharedRam.create(
+                shared_memory, len(layout.segments), len(layout.touches)
+            )
+        self.bus = DeviceBus()
+        self.touch = self.bus.attach(
+            TouchDevice(layout, memory=self.shared and self.shared.touch)
+        )
+        self.lcd = self.bus.attach(
+            LcdDevice(
+                layout,
+                memory=self.shared and self.shared.display,
+                bits_per_element=bits_per_element,
+                palette=palette,
+            )
+        )
+        self.bus.attach(DiagnosticsDevice(self))
+        for device in devices:
+            self.bus.attach(device)
+
+        # A ROUTER accepts pipelined requests from many REQ or DEALER clients
+        context = context or zmq.Context.instance()
+        self.socket = context.socket(zmq.ROUTER if router else zmq.REP)
+        self.socket.bind(endpoint)
+
+        # Statistics cost nothing but a None check per message when disabled
+        self.stats = SimulatorStats() if stats or stats_endpoint else None
+        self.stats_socket = None
+        if self.stats:
+            self.lcd.redraw_latency = self.stats.redraw
+        if stats_endpoint:
+            self.stats_socket = context.socket(zmq.PUB)
+            self.stats_socket.bind(stats_endpoint)
+
+        self.interrupt_socket = None
+        if interrupt_endpoint:
+            self.interrupt_socket = context.socket(zmq.PUB)
+            self.interrupt_socket.bind(interrupt_endpoint)
+
+        self.recorder = TrafficRecorder(record) if record else None
+        self.bus_profiler = bus_profiler
+
+        self.doorbell = None
+        if self.shared:
+            self.doorbell = context.socket(zmq.PULL)
+            self.doorbell.bind(doorbell_endpoint)
+            # Display RAM as last notified, to find what local clients changed
+            self._notified = RamMemory(len(layout.segments))
+            self.lcd.subscribe(self._track_notified)
+
+        for device in self.bus.devices.values():
+            if not isinstance(device, TouchDevice):
+                continue
+            if self.interrupt_socket is not None:
+                device.subscribe(functools.partial(self.interrupt, device.address))
+            if self.recorder is not None:
+                device.subscribe(functools.partial(self.recorder.touch, device.address))
+
+        self.transaction_count = 0
+        self.transactions_per_second = 0.0
+        self._rate_start = (time.monotonic(), 0)
+
+        # Callbacks for the serving thread, its poller wakes on the socket pair
+        self._calls: Deque[Tuple[Callable, tuple]] = deque()
+        self._wake_reader, self._wake_writer = socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def process_message(self, message: bytes) -> bytes:
+        """Process a received message and reply."""
+        return self.bus.process_message(message)
+
+    def interrupt(self, address: int, event: TouchEvent) -> None:
+        """Raise the interrupt line of the touch controller at `address`."""
+        self.interrupt_socket.send_multipart(
+            [TOUCH_INTERRUPT_TOPIC, bytes((address,)), SEQUENCE.pack(event.sequence)]
+        )
+
+    def service_socket(self) -> int:
+        """Reply to every pending message in arrival order and get the number handled.
+
+        On a ROUTER socket every message is prefixed with the client identity and
+        correlation id frames, these are sent back unchanged with the reply.
+        """
+        handled = 0
+        woken = time.perf_counter()
+        # Reading zmq.EVENTS also re-arms the edge triggered zmq.FD
+        while self.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            try:
+                *envelope, message = self.socket.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if self.recorder is not None:
+                self.recorder.record(REQUEST, message)
+            if self.stats is None:
+                reply = self.process_message(message)
+            else:
+                reply = self._process_measured(message, woken)
+            if self.recorder is not None:
+                self.recorder.record(REPLY, reply)
+            if self.bus_profiler is not None:
+                acked = bool(message) and message[0] in self.bus
+                self.bus_profiler.record(message, reply, time.monotonic(), acked)
+            self.socket.send_multipart([*envelope, reply])
+            handled += 1
+        self.transaction_count += handled
+        return handled
+
+    def service_doorbell(self) -> int:
+        """Notify the segments local clients changed and get the number of rings.
+
+        All pending rings are handled with a single comparison of the display RAM.
+        """
+        rings = 0
+        while True:
+            try:
+                self.doorbell.recv(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            rings += 1
+        if rings:
+            try:
+                display = self.lcd.display_state.as_bytes()
+            except TimeoutError as error:
+                # A client died writing the display, keep serving the others
+                print(f"Could not read the shared display: {error}")
+                return rings
+            self.lcd.notify(self._notified.write_from_bytes(display))
+        return rings
+
+    def _track_notified(self, changed: Iterable[int]) -> None:
+        for idx in changed:
+            if self.lcd.display_state.get_bit(idx):
+                self._notified.set_bit(idx)
+            else:
+                self._notified.clear_bit(idx)
+
+    def _process_measured(self, message: bytes, woken: float) -> bytes:
+        """Process a message recording its batch wait, the time since the
+        drain of the socket started at `woken`, and how long it took."""
+        start = time.perf_counter()
+        reply = self.process_message(message)
+        self.stats.record(message, reply, start - woken, time.perf_counter() - start)
+        return reply
+
+    def report_rate(self) -> float:
+        """Update and print the transactions per second since the last report."""
+        start_time, start_count = self._rate_start
+        now = time.monotonic()
+        transactions = self.transaction_count - start_count
+        self.transactions_per_second = transactions / (now - start_time)
+        self._rate_start = (now, self.transaction_count)
+        if transactions:
+            print(f"{self.transactions_per_second:.1f} transactions/s")
+        return self.transactions_per_second
+
+    def report(self) -> None:
+        """Periodic report of the rate, and the statistics when enabled."""
+        self.report_rate()
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.bus_profiler is not None and self.bus_profiler.commands:
+            print(self.bus_profiler.format_summary())
+        if self.stats is None:
+            return
+        if self.stats.commands:
+            print(self.stats.format_summary())
+        if self.stats_socket is not None:
+            self.stats_socket.send_multipart([b"stats", self.stats.to_json()])
+
+    def call_soon(self, callback: Callable, *args) -> None:
+        """Run `callback(*args)` on the thread serving the bus, from any thread."""
+        self._calls.append((callback, args))
+        # A full socket pair already holds a wake up
+        with contextlib.suppress(BlockingIOError):
+            self._wake_writer.send(b"\0")
+
+    def run_calls(self) -> int:
+        """Run the callbacks queued with `call_soon` and get their number."""
+        with contextlib.suppress(BlockingIOError):
+            while self._wake_reader.recv(4096):
+                pass
+        calls = 0
+        while self._calls:
+            callback, args = self._calls.popleft()
+            callback(*args)
+            calls += 1
+        return calls
+
+    def start(self) -> threading.Thread:
+        """Serve on a background I/O thread until `stop` or `close`."""
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="lcd-io", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        """Make `serve_forever` return, and wait for the I/O thread to end."""
+        self._stopping = True
+        self.call_soon(lambda: None)
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def serve_forever(self) -> None:
+        """Serve requests without a GUI at full speed, until `stop` is called."""
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        if self.doorbell is not None:
+            poller.register(self.doorbell, zmq.POLLIN)
+        poller.register(self._wake_reader, zmq.POLLIN)
+        next_report = time.monotonic() + RATE_REPORT_INTERVAL_MS / 1000
+        while not self._stopping:
+            timeout_ms = max(0.0, next_report - time.monotonic()) * 1000
+            ready = dict(poller.poll(timeout_ms))
+            # Plain sockets are reported by file descriptor
+            if self._wake_reader.fileno() in ready:
+                self.run_calls()
+            if self.socket in ready:
+                self.service_socket()
+            if self.doorbell in ready:
+                self.service_doorbell()
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report = time.monotonic() + RATE_REPORT_INTERVAL_MS / 1000
+
+    def close(self) -> None:
+        """Stop the I/O thread, close the sockets, traffic log and shared memory."""
+        if self._thread is not None:
+            self.stop()
+        self._wake_reader.close()
+        self._wake_writer.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        sockets = (self.socket, self.stats_socket, self.interrupt_socket, self.doorbell)
+        for socket in sockets:
+            if socket is not None:
+                socket.close()
+        if self.shared is not None:
+            self.shared.close()
+
+
+def add_simulator_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of the simulator to an argument parser."""
+    parser.add_argument("--mask", default="Masked.svg")
+    parser.add_argument("--endpoint", default=DEFAULT_ENDPOINT)
+    parser.add_argument(
+        "--router",
+        action="store_true",
+        help="serve pipelined requests from multiple clients",
+    )
+    parser.add_argument(
+        "--bits-per-element",
+        type=int,
+        default=1,
+        help="bits of each segment, for grayscale or colour displays",
+    )
+    parser.add_argument(
+        "--palette",
+        choices=PALETTE_KINDS,
+        default="gray",
+        help="colors of the segment values, rgb splits the bits in three channels",
+    )
+    parser.add_argument(
+        "--refresh-rate",
+        type=float,
+        default=DEFAULT_REFRESH_RATE,
+        help="render at most this many frames per second, 0 renders every write",
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="collect latency and throughput statistics"
+    )
+    parser.add_argument("--stats-endpoint", help="publish the statistics on this PUB")
+    parser.add_argument(
+        "--interrupt-endpoint",
+        default=DEFAULT_INTERRUPT_ENDPOINT,
+        help="publish touch events on this PUB, empty to disable",
+    )
+    parser.add_argument(
+        "--record", metavar="LOG", help="append all bus traffic to this traffic log"
+    )
+    parser.add_argument(
+        "--shared-memory",
+        metavar="NAME",
+        help="share the display and touch RAM with local clients in this block",
+    )
+    parser.add_argument("--doorbell-endpoint", default=DEFAULT_DOORBELL_ENDPOINT)
+    parser.add_argument(
+        "--bus-speed",
+        choices=BUS_SPEEDS,
+        help="charge every transaction its time on an I2C bus of this clock rate",
+    )
+    parser.add_argument(
+        "--bus-budget-ms",
+        type=float,
+        help="flag frames with more bus time than this, by default the whole frame",
+    )
+    parser.add_argument(
+        "--device",
+        action="append",
+        default=[],
+        metavar="KIND:ADDRESS:SVG",
+        help="add a headless lcd or touch device to the bus, e.g. lcd:0x34:Status.svg",
+    )
+
+
+def simulator_from_args(args: argparse.Namespace) -> "LcdSimulator":
+    """Get a simulator configured by the options of `add_simulator_arguments`."""
+    devices = []
+    for spec in args.device:
+        kind, address, path = spec.split(":", 2)
+        devices.append(DEVICE_TYPES[kind](load_layout_cached(path), int(address, 0)))
+
+    bus_profiler = None
+    if args.bus_speed:
+        bus_profiler = BusProfiler(
+            I2cBusModel(BUS_SPEEDS[args.bus_speed]),
+            1 / (args.refresh_rate or DEFAULT_REFRESH_RATE),
+            None if args.bus_budget_ms is None else args.bus_budget_ms / 1000,
+        )
+
+    return LcdSimulator(
+        load_layout_cached(args.mask),
+        endpoint=args.endpoint,
+        router=args.router,
+        stats=args.stats,
+        stats_endpoint=args.stats_endpoint,
+        devices=devices,
+        interrupt_endpoint=args.interrupt_endpoint,
+        record=args.record,
+        shared_memory=args.shared_memory,
+        doorbell_endpoint=args.doorbell_endpoint,
+        bus_profiler=bus_profiler,
+        bits_per_element=args.bits_per_element,
+        palette=args.palette,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the simulator headless, without a GUI toolkit."
+    )
+    add_simulator_arguments(parser)
+    simulator = simulator_from_args(parser.parse_args())
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Flushes the traffic log
+        simulator.close()
@@ -0,0 +1,157 @@
+"""Addresses, commands and bit helpers of the simulated I2C-like protocol.
+
+Only depends on the standard library, so clients can import it without pulling
+in the simulator.
+"""
+import itertools
+import struct
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+I2C_TOUCH_ADDRESS = 0x30
+I2C_LCD_ADDRESS = 0x32
+
+I2C_TOUCH_READ_CMD = 0x20
+I2C_TOUCH_READ_EVENTS_CMD = 0x21
+
+I2C_LCD_READ_CMD = 0x40
+I2C_LCD_WRITE_ALL_CMD = 0x41
+I2C_LCD_WRITE_SINGLE_CMD = 0x42
+I2C_LCD_WRITE_RANGE_CMD = 0x43
+I2C_LCD_SET_MASK_CMD = 0x44
+I2C_LCD_CLEAR_MASK_CMD = 0x45
+I2C_LCD_BATCH_CMD = 0x46
+I2C_LCD_WRITE_ELEMENTS_CMD = 0x47
+I2C_LCD_SNAPSHOT_PNG_CMD = 0x4E
+I2C_LCD_SNAPSHOT_CMD = 0x4F
+
+# Diagnostics of the simulator itself, not part of any real device
+I2C_SIM_ADDRESS = 0x7F
+I2C_SIM_STATS_CMD = 0x01
+
+# Commands whose reply is read back from the device, all others are writes
+READ_COMMANDS = frozenset(
+    (
+        I2C_TOUCH_READ_CMD,
+        I2C_TOUCH_READ_EVENTS_CMD,
+        I2C_LCD_READ_CMD,
+        I2C_LCD_SNAPSHOT_PNG_CMD,
+        I2C_LCD_SNAPSHOT_CMD,
+        I2C_SIM_STATS_CMD,
+    )
+)
+
+ILLEGAL_PREFIX = b"Illegal: "
+
+DEFAULT_ENDPOINT = "tcp://*:5555"
+DEFAULT_CONNECT_ENDPOINT = "tcp://localhost:5555"
+
+# Shared memory transport for clients on the same host
+DEFAULT_SHARED_MEMORY_NAME = "custom_lcd"
+DEFAULT_DOORBELL_ENDPOINT = "tcp://127.0.0.1:5558"
+
+# The touch interrupt line, published on every touch event
+DEFAULT_INTERRUPT_ENDPOINT = "tcp://*:5557"
+DEFAULT_INTERRUPT_CONNECT_ENDPOINT = "tcp://localhost:5557"
+TOUCH_INTERRUPT_TOPIC = b"touch"
+
+# Sequence number, monotonic timestamp in microseconds, touch surface and pressed
+TOUCH_EVENT = struct.Struct(">IQHB")
+SEQUENCE = struct.Struct(">I")
+# Byte offset and length of a range operation, followed by length bytes
+RANGE = struct.Struct(">HH")
+# First element and element count of an elements write, followed by the packed values
+ELEMENTS = struct.Struct(">HH")
+
+
+class TouchEvent(NamedTuple):
+    """A touch surface pressed or released."""
+
+    sequence: int
+    timestamp_us: int
+    index: int
+    pressed: bool
+
+
+def set_bits(data: bytes) -> List[int]:
+    """Get the indices of the set bits, bit 0 is the most significant bit of byte 0."""
+    return [
+        idx * 8 + bit
+        for idx, byte in enumerate(data)
+        if byte
+        for bit in range(8)
+        if byte & (0x80 >> bit)
+    ]
+
+
+def pack_bits(indices: Iterable[int], bit_count: int) -> bytes:
+    """Get the bytes of `bit_count` bits with the bits at `indices` set."""
+    data = bytearray((bit_count + 7) // 8)
+    for idx in indices:
+        data[idx // 8] |= 0x80 >> (idx % 8)
+    return bytes(data)
+
+
+def touch_events_request(address: int, sequence: Optional[int]) -> bytes:
+    """Get the message reading the touch events from `sequence` on.
+
+    Without a sequence the reply only holds the sequence of the next event.
+    """
+    message = bytes((address, I2C_TOUCH_READ_EVENTS_CMD))
+    return message if sequence is None else message + SEQUENCE.pack(sequence)
+
+
+def unpack_touch_events(data: bytes) -> Tuple[int, List[TouchEvent]]:
+    """Get the sequence of the next event and the events of a touch events reply."""
+    (next_sequence,) = SEQUENCE.unpack_from(data)
+    events = [
+        TouchEvent(sequence, timestamp_us, index, bool(pressed))
+        for sequence, timestamp_us, index, pressed in TOUCH_EVENT.iter_unpack(
+            data[SEQUENCE.size :]
+        )
+    ]
+    return next_sequence, events
+
+
+def range_operation(command: int, offset: int, data: bytes) -> bytes:
+    """Get a ranged write, set mask or clear mask operation, without the address.
+
+    Prefixed with the address it is a message, concatenated operations are the
+    payload of `I2C_LCD_BATCH_CMD`.
+    """
+    return bytes((command,)) + RANGE.pack(offset, len(data)) + bytes(data)
+
+
+def bit_mask(index: int) -> Tuple[int, bytes]:
+    """Get the byte offset and single byte mask of a bit."""
+    return index // 8, bytes((0x80 >> (index % 8),))
+
+
+def pack_elements(values: Iterable[int], bits_per_element: int) -> bytes:
+    """Get values packed back to back, `bits_per_element` bits each, most
+    significant bit first and zero padded to whole bytes."""
+    mask = (1 << bits_per_element) - 1
+    values = iter(values)
+    chunks = []
+    count = 0
+    # 8 values fill `bits_per_element` whole bytes, packing a group at a time
+    # keeps the words small and the cost linear in the number of values
+    for group in iter(lambda: list(itertools.islice(values, 8)), []):
+        word = 0
+        for value in group:
+            word = (word << bits_per_element) | (value & mask)
+        word <<= (8 - len(group)) * bits_per_element
+        chunks.append(word.to_bytes(bits_per_element, "big"))
+        count += len(group)
+    return b"".join(chunks)[: (count * bits_per_element + 7) // 8]
+
+
+def elements_request(
+    address: int, first: int, values: Iterable[int], bits_per_element: int
+) -> bytes:
+    """Get the message writing the values of consecutive elements from `first` on."""
+    values = list(values)
+    return (
+        bytes((address, I2C_LCD_WRITE_ELEMENTS_CMD))
+        + ELEMENTS.pack(first, len(values))
+        + pack_elements(values, bits_per_element)
+    )
@@ -0,0 +1,153 @@
+"""Per command latency and throughput statistics of the simulator."""
+import json
+from typing import Dict, List, Optional
+
+
+class Histogram:
+    """Latency histogram with power of two microsecond buckets.
+
+    Bucket n counts the samples below 2**n microseconds, the last one is open ended.
+    """
+
+    BUCKETS = 24
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds: float) -> None:
+        """Add a sample."""
+        bucket = int(seconds * 1e6).bit_length()
+        self.counts[min(bucket, self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        """Add the samples of another histogram."""
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, percentile: float) -> float:
+        """Get the upper bound in microseconds of the bucket holding a percentile."""
+        remaining = self.count * percentile / 100
+        for bucket, count in enumerate(self.counts):
+            remaining -= count
+            if remaining <= 0:
+                return float(2**bucket)
+        return self.maximum * 1e6
+
+    def summary(self) -> Dict[str, float]:
+        """Get count, mean, max, p50 and p99 in microseconds."""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_us": round(self.total / self.count * 1e6, 1),
+            "max_us": round(self.maximum * 1e6, 1),
+            "p50_us": self.percentile(50),
+            "p99_us": self.percentile(99),
+        }
+
+
+class CommandStats:
+    """Counters of a single address and command."""
+
+    __slots__ = ("count", "request_bytes", "reply_bytes", "latency")
+
+    def __init__(self):
+        self.count = 0
+        self.request_bytes = 0
+        self.reply_bytes = 0
+        self.latency = Histogram()
+
+
+class SimulatorStats:
+    """Counters per I2C address and command, and batch wait, processing and
+    redraw latency histograms.
+
+    The batch wait of a message is the time from the simulator starting to
+    drain the messages pending on its socket to processing this one, so it
+    includes the processing of the messages before it in the same batch.
+    ZeroMQ does not timestamp arrivals, the time a message was queued before
+    the drain started is not measured.
+    """
+
+    def __init__(self):
+        self.commands: Dict[str, CommandStats] = {}
+        self.batch_wait = Histogram()
+        self.processing = Histogram()
+        self.redraw = Histogram()
+
+    def record(
+        self, message: bytes, reply: Optional[bytes], wait: float, duration: float
+    ) -> None:
+        """Record a processed message, with its batch wait and processing time."""
+        key = "/".join(f"0x{byte:02x}" for byte in message[:2])
+        command = self.commands.get(key)
+        if command is None:
+            command = self.commands[key] = CommandStats()
+        command.count += 1
+        command.request_bytes += len(message)
+        command.reply_bytes += len(reply) if reply else 0
+        command.latency.add(duration)
+        self.batch_wait.add(wait)
+        self.processing.add(duration)
+
+    def merge(self, other: "SimulatorStats") -> None:
+        """Add the statistics of another simulator, for totals over many."""
+        for key, theirs in other.commands.items():
+            command = self.commands.get(key)
+            if command is None:
+                command = self.commands[key] = CommandStats()
+            command.count += theirs.count
+            command.request_bytes += theirs.request_bytes
+            command.reply_bytes += theirs.reply_bytes
+            command.latency.merge(theirs.latency)
+        self.batch_wait.merge(other.batch_wait)
+        self.processing.merge(other.processing)
+        self.redraw.merge(other.redraw)
+
+    def summary(self) -> Dict:
+        """Get all statistics as json serialisable dict."""
+        return {
+            "commands": {
+                key: {
+                    "count": command.count,
+                    "request_bytes": command.request_bytes,
+                    "reply_bytes": command.reply_bytes,
+                    "latency": command.latency.summary(),
+                }
+                for key, command in sorted(self.commands.items())
+            },
+            "batch_wait": self.batch_wait.summary(),
+            "processing": self.processing.summary(),
+            "redraw": self.redraw.summary(),
+        }
+
+    def to_json(self) -> bytes:
+        """Get the summary as json."""
+        return json.dumps(self.summary()).encode()
+
+    def format_summary(self) -> str:
+        """Get a human readable summary."""
+        lines: List[str] = []
+        for key, command in sorted(self.commands.items()):
+            latency = command.latency.summary()
+            lines.append(
+                f"{key}: {command.count} msgs, {command.request_bytes} B in,"
+                f" {command.reply_bytes} B out, mean {latency['mean_us']} us,"
+                f" p99 < {latency['p99_us']:.0f} us"
+            )
+        for name in ("batch_wait", "processing", "redraw"):
+            histogram = getattr(self, name).summary()
+            if histogram["count"]:
+                lines.append(
+                    f"{name}: mean {histogram['mean_us']} us,"
+                    f" p99 < {histogram['p99_us']:.0f} us, max {histogram['max_us']} us"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,157 @@
+"""Colours and palettes of the renderers.
+
+A palette maps every element value to an RGBA colour, a segment with value n is
+drawn with color n. The colors are computed from the value on demand, so
+elements of up to 32 bits need no table of every color. numpy is only needed to
+look up arrays of values.
+"""
+import abc
+from typing import Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only needed for the array lookups
+    np = None
+
+Color = Union[str, Tuple[int, int, int, int]]
+RGBA = Tuple[int, int, int, int]
+
+TRANSPARENT = (0, 0, 0, 0)
+_NAMED_COLORS = {
+    "black": (0, 0, 0, 255),
+    "white": (255, 255, 255, 255),
+    "red": (255, 0, 0, 255),
+    "green": (0, 128, 0, 255),
+    "blue": (0, 0, 255, 255),
+    "gray": (190, 190, 190, 255),
+    "grey": (190, 190, 190, 255),
+}
+
+PALETTE_KINDS = ("gray", "rgb")
+# A palette kind, a list of colors or a palette
+PaletteSpec = Union[str, Sequence[Color], "Palette"]
+
+
+def parse_color(color: Color) -> RGBA:
+    """Get RGBA of a color, "" and "none" are transparent like on a Tk canvas."""
+    if not isinstance(color, str):
+        return tuple(color)
+    if color in ("", "none"):
+        return TRANSPARENT
+    if color.startswith("#") and len(color) in (4, 7):
+        digits = color[1:] if len(color) == 7 else "".join(c * 2 for c in color[1:])
+        return tuple(int(digits[idx : idx + 2], 16) for idx in (0, 2, 4)) + (255,)
+    try:
+        return _NAMED_COLORS[color.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown color {color!r}, use #rrggbb") from None
+
+
+def hex_color(rgba: RGBA) -> str:
+    """Get the #rrggbb color of Tk and svg, "" when transparent."""
+    return "" if rgba[3] == 0 else "#{:02x}{:02x}{:02x}".format(*rgba[:3])
+
+
+class Palette(abc.ABC):
+    """Colors of element values, computed on demand from a few parameters so
+    elements of many bits need no table with a color per value."""
+
+    @abc.abstractmethod
+    def __getitem__(self, value: int) -> RGBA:
+        """Get the color of a value."""
+
+    @abc.abstractmethod
+    def colors(self, values: "np.ndarray") -> "np.ndarray":
+        """Get the colors of a numpy array of values as n x 4 uint8 array."""
+
+
+class ListPalette(Palette):
+    """Palette of a color per value, value n is color n of `colors`."""
+
+    def __init__(self, colors: Sequence[Color]):
+        self.table = [parse_color(color) for color in colors]
+        self._array = None if np is None else np.array(self.table, dtype=np.uint8)
+
+    def __getitem__(self, value: int) -> RGBA:
+        return self.table[value]
+
+    def colors(self, values: "np.ndarray") -> "np.ndarray":
+        return self._array[values]
+
+
+class GrayPalette(Palette):
+    """Intensities fading from `off_color` to `on_color`, value 0 is `off_color`.
+
+    With a transparent off color the on color fades in by its alpha.
+    """
+
+    def __init__(self, bits_per_element: int, on_color: Color, off_color: Color):
+        self.on, self.off = parse_color(on_color), parse_color(off_color)
+        self.start = self.on[:3] + (0,) if self.off[3] == 0 else self.off
+        self.top = (1 << bits_per_element) - 1
+
+    def __getitem__(self, value: int) -> RGBA:
+        if not value:
+            return self.off
+        return tuple(
+            round(low + (high - low) * value / self.top)
+            for low, high in zip(self.start, self.on)
+        )
+
+    def colors(self, values: "np.ndarray") -> "np.ndarray":
+        start = np.array(self.start, dtype=np.float64)
+        span = np.array(self.on, dtype=np.float64) - start
+        levels = values.astype(np.float64)[:, None]
+        colors = np.rint(start + span * levels / self.top).astype(np.uint8)
+        colors[values == 0] = self.off
+        return colors
+
+
+class RgbPalette(Palette):
+    """Palette of RGB elements, red, green and blue get a third of the bits
+    each, red the most significant ones. Value 0 is `off_color`."""
+
+    def __init__(self, bits_per_element: int, off_color: Color = ""):
+        if bits_per_element % 3:
+            raise ValueError("RGB elements need a multiple of 3 bits")
+        channel = bits_per_element // 3
+        self.off = parse_color(off_color)
+        self.mask = (1 << channel) - 1
+        self.shifts = (2 * channel, channel, 0)
+        # Intensity of each channel value, the same table for all channels
+        self.levels = [round(level * 255 / self.mask) for level in range(self.mask + 1)]
+        self._levels = None if np is None else np.array(self.levels, dtype=np.uint8)
+
+    def __getitem__(self, value: int) -> RGBA:
+        if not value:
+            return self.off
+        return tuple(
+            self.levels[(value >> shift) & self.mask] for shift in self.shifts
+        ) + (255,)
+
+    def colors(self, values: "np.ndarray") -> "np.ndarray":
+        values = values.astype(np.int64)
+        colors = np.full((len(values), 4), 255, dtype=np.uint8)
+        for channel, shift in enumerate(self.shifts):
+            colors[:, channel] = self._levels[(values >> shift) & self.mask]
+        colors[values == 0] = self.off
+        return colors
+
+
+def make_palette(
+    palette: PaletteSpec,
+    bits_per_element: int = 1,
+    on_color: Color = "black",
+    off_color: Color = "",
+) -> Palette:
+    """Get the palette of a kind, "gray" or "rgb", of a list of colors, or the
+    palette itself, for elements of `bits_per_element` bits."""
+    if isinstance(palette, Palette):
+        return palette
+    if palette == "rgb":
+        return RgbPalette(bits_per_element, off_color)
+    if palette == "gray":
+        return GrayPalette(bits_per_element, on_color, off_color)
+    if isinstance(palette, str):
+        raise ValueError(f"Unknown palette {palette!r}, use one of {PALETTE_KINDS}")
+    return ListPalette(palette)
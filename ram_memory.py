@@ -0,0 +1,305 @@
+"""Bit addressable RAM memory used for the display and touch state.
+
+`PackedMemory` holds displays with several bits per segment.
+"""
+import itertools
+import operator
+import re
+from typing import Callable, Iterable, Iterator, Sequence, Set, Sized, Tuple
+
+from lcd_protocol import pack_elements
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only needed for the array views
+    np = None
+
+# Value of each bit in a byte, most significant bit first
+_BYTE_BITS = [
+    tuple((value >> (7 - bit)) & 1 for bit in range(8)) for value in range(256)
+]
+# Offsets of the set bits in a byte, most significant bit first
+_SET_BIT_OFFSETS = [
+    tuple(bit for bit, value in enumerate(bits) if value) for bits in _BYTE_BITS
+]
+_NON_ZERO_BYTE = re.compile(rb"[^\x00]")
+
+
+def _replace(old: int, new: int) -> int:
+    return new
+
+
+def _and_not(old: int, mask: int) -> int:
+    return old & ~mask
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for array access to RamMemory")
+
+
+class RamMemory:
+    """Block of RAM memory.
+
+    Bit 0 is the most significant bit of the first byte. All operations mutate the
+    memory in place, `view` is a zero-copy memoryview on it. The memory is a new
+    bytearray, or an existing writable `buffer` of the right size such as shared
+    memory.
+    """
+
+    # Elements are the segments of the display, one bit each unless packed
+    bits_per_element = 1
+
+    def __init__(self, bit_count: int, buffer=None):
+        size = (bit_count + 7) // 8
+        if buffer is None:
+            buffer = bytearray(size)
+        elif len(buffer) != size:
+            raise ValueError(f"Buffer of {len(buffer)} bytes, expected {size}")
+        self._memory = buffer
+        self._zeros = bytes(size)
+        self._bit_count = bit_count
+        self.view = memoryview(self._memory)
+
+    def __len__(self) -> int:
+        return self._bit_count
+
+    def write_from_bytes(self, data: bytes) -> Set[int]:
+        """Copy bytes to RAM object respecting the size of the bytearray.
+
+        Returns the indices of the bits that changed, found by XOR-ing the old and
+        new bytes so the cost scales with the number of changed bits.
+        """
+        return self.write_range(0, data)
+
+    def write_range(self, offset: int, data: bytes) -> Set[int]:
+        """Copy bytes to RAM from byte `offset` on and get the changed bits."""
+        return self._combine_range(offset, data, _replace)
+
+    def set_mask(self, offset: int, mask: bytes) -> Set[int]:
+        """Set the bits of `mask` from byte `offset` on and get the changed bits."""
+        return self._combine_range(offset, mask, operator.or_)
+
+    def clear_mask(self, offset: int, mask: bytes) -> Set[int]:
+        """Clear the bits of `mask` from byte `offset` on and get the changed bits."""
+        return self._combine_range(offset, mask, _and_not)
+
+    def _combine_range(
+        self, offset: int, data: bytes, combine: Callable[[int, int], int]
+    ) -> Set[int]:
+        # Bytes beyond the end of the memory are ignored
+        end = min(offset + len(data), len(self._memory))
+        if end <= offset:
+            return set()
+        length = end - offset
+        old = int.from_bytes(self.view[offset:end], "big")
+        new = combine(old, int.from_bytes(memoryview(data)[:length], "big"))
+        diff = old ^ new
+        if not diff:
+            return set()
+        self.view[offset:end] = new.to_bytes(length, "big")
+        return self._changed_bits(diff.to_bytes(length, "big"), offset)
+
+    def _changed_bits(self, diff: bytes, byte_offset: int = 0) -> Set[int]:
+        first_bit = byte_offset * 8
+        if np is not None and len(diff) > 1024:
+            diff = np.frombuffer(diff, dtype=np.uint8)
+            byte_indices = np.flatnonzero(diff)
+            rows, offsets = np.nonzero(np.unpackbits(diff[byte_indices]).reshape(-1, 8))
+            changed = set((byte_indices[rows] * 8 + offsets + first_bit).tolist())
+        else:
+            changed = set()
+            for match in _NON_ZERO_BYTE.finditer(diff):
+                byte_index = match.start()
+                changed.update(
+                    first_bit + byte_index * 8 + offset
+                    for offset in _SET_BIT_OFFSETS[diff[byte_index]]
+                )
+        changed.difference_update(range(self._bit_count, first_bit + len(diff) * 8))
+        return changed
+
+    def get_bit(self, idx: int) -> int:
+        """Get value of single bit of memory."""
+        return (self._memory[idx // 8] >> (7 - idx % 8)) & 1
+
+    def set_bit(self, idx: int) -> None:
+        """Set single bit of memory."""
+        self._memory[idx // 8] |= 0x80 >> (idx % 8)
+
+    def clear_bit(self, idx: int) -> None:
+        """Clear single bit of memory."""
+        self._memory[idx // 8] &= ~(0x80 >> (idx % 8)) & 0xFF
+
+    def toggle_bit(self, idx: int) -> None:
+        """Toggle single bit of memory."""
+        self._memory[idx // 8] ^= 0x80 >> (idx % 8)
+
+    def set_bits(self, indices: Iterable[int]) -> None:
+        """Set all bits in indices, vectorised when given a numpy array."""
+        if np is not None and isinstance(indices, np.ndarray):
+            np.bitwise_or.at(self.as_array(), *self._byte_masks(indices))
+        else:
+            for idx in indices:
+                self.set_bit(idx)
+
+    def clear_bits(self, indices: Iterable[int]) -> None:
+        """Clear all bits in indices, vectorised when given a numpy array."""
+        if np is not None and isinstance(indices, np.ndarray):
+            byte_indices, masks = self._byte_masks(indices)
+            np.bitwise_and.at(self.as_array(), byte_indices, ~masks)
+        else:
+            for idx in indices:
+                self.clear_bit(idx)
+
+    def toggle_bits(self, indices: Iterable[int]) -> None:
+        """Toggle all bits in indices, vectorised when given a numpy array.
+
+        An index that occurs twice is toggled twice.
+        """
+        if np is not None and isinstance(indices, np.ndarray):
+            np.bitwise_xor.at(self.as_array(), *self._byte_masks(indices))
+        else:
+            for idx in indices:
+                self.toggle_bit(idx)
+
+    @staticmethod
+    def _byte_masks(indices) -> Tuple["np.ndarray", "np.ndarray"]:
+        indices = indices.astype(np.intp, copy=False)
+        return indices >> 3, (0x80 >> (indices & 7)).astype(np.uint8)
+
+    def as_bytes(self) -> bytes:
+        """Get entire memory as bytes."""
+        return bytes(self._memory)
+
+    def as_array(self) -> "np.ndarray":
+        """Get a writable zero-copy numpy uint8 array on the memory."""
+        _require_numpy()
+        return np.frombuffer(self._memory, dtype=np.uint8)
+
+    def unpack_bits(self) -> "np.ndarray":
+        """Get the value of every bit as a numpy uint8 array of bit_count entries."""
+        return np.unpackbits(self.as_array(), count=self._bit_count)
+
+    def clear(self) -> None:
+        """Clear all memory to 0."""
+        self.view[:] = self._zeros
+
+    def iterate_bits(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over each bit in RAM memory and get each bit index and value."""
+        bits = itertools.chain.from_iterable(map(_BYTE_BITS.__getitem__, self._memory))
+        return zip(range(self._bit_count), bits)
+
+    def get_element(self, idx: int) -> int:
+        """Get the value of an element."""
+        width = self.bits_per_element
+        start = idx * width
+        first, end = start >> 3, (start + width + 7) >> 3
+        word = int.from_bytes(self.view[first:end], "big")
+        return (word >> (end * 8 - start - width)) & ((1 << width) - 1)
+
+    def write_elements(self, first: int, data: bytes, count: int) -> Set[int]:
+        """Write `count` packed element values from element `first` on.
+
+        Returns the indices of the elements that changed. Raises ValueError when
+        the elements do not fit the memory or `data` holds fewer values.
+        """
+        start, width = first * self.bits_per_element, count * self.bits_per_element
+        if start + width > self._bit_count or len(data) * 8 < width:
+            raise ValueError(f"{count} elements from {first} do not fit")
+        if not (start | width) & 7:
+            return self.write_range(start >> 3, data[: width >> 3])
+        # Merge the values into the bytes they partially cover
+        first_byte, end_byte = start >> 3, (start + width + 7) >> 3
+        shift = end_byte * 8 - start - width
+        mask = ((1 << width) - 1) << shift
+        values = int.from_bytes(data, "big") >> (len(data) * 8 - width)
+        old = int.from_bytes(self.view[first_byte:end_byte], "big")
+        new = (old & ~mask) | (values << shift)
+        return self.write_range(first_byte, new.to_bytes(end_byte - first_byte, "big"))
+
+    def write_values(self, first: int, values) -> Set[int]:
+        """Write the values of consecutive elements, vectorised for numpy arrays."""
+        if not isinstance(values, Sized):
+            values = list(values)
+        data = pack_values(values, self.bits_per_element)
+        return self.write_elements(first, data, len(values))
+
+    def unpack_elements(self) -> "np.ndarray":
+        """Get the value of every element as a numpy array."""
+        return self.unpack_bits()
+
+    def iterate_elements(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over each element and get its index and value."""
+        return self.iterate_bits()
+
+    def copy(self) -> "RamMemory":
+        """Get an independent copy of the memory."""
+        return RamMemory(self._bit_count, bytearray(self.as_bytes()))
+
+
+def pack_values(values: Sequence[int], bits_per_element: int) -> bytes:
+    """Get element values packed like `lcd_protocol.pack_elements`, vectorised
+    when numpy is available."""
+    if np is None:
+        return pack_elements(values, bits_per_element)
+    shifts = np.arange(bits_per_element - 1, -1, -1, dtype=np.uint32)
+    bits = (np.asarray(values, dtype=np.uint32)[:, None] >> shifts) & 1
+    return np.packbits(bits.astype(np.uint8).ravel()).tobytes()
+
+
+class PackedMemory(RamMemory):
+    """RAM of elements of several bits, for grayscale or colour segments.
+
+    Element values are packed back to back, most significant bit first, so the
+    memory and the messages writing it grow with `bits_per_element` and no
+    Python object is kept per element. Its length is the number of elements,
+    and the writes report which elements changed.
+    """
+
+    def __init__(self, element_count: int, bits_per_element: int, buffer=None):
+        if not 1 <= bits_per_element <= 32:
+            raise ValueError("Elements can have 1 to 32 bits")
+        super().__init__(element_count * bits_per_element, buffer)
+        self.element_count = element_count
+        self.bits_per_element = bits_per_element
+        # Place value of each bit of an element, to unpack with one product
+        self._weights = (
+            None if np is None else 1 << np.arange(bits_per_element - 1, -1, -1)
+        )
+
+    def __len__(self) -> int:
+        return self.element_count
+
+    def _changed_bits(self, diff: bytes, byte_offset: int = 0) -> Set[int]:
+        width = self.bits_per_element
+        return {bit // width for bit in super()._changed_bits(diff, byte_offset)}
+
+    def unpack_elements(self) -> "np.ndarray":
+        """Get the value of every element as a numpy array."""
+        bits = self.unpack_bits().reshape(self.element_count, self.bits_per_element)
+        return bits @ self._weights
+
+    def iterate_elements(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over each element and get its index and value."""
+        if np is not None:
+            return enumerate(self.unpack_elements().tolist())
+        return zip(range(self.element_count), self._iterate_values())
+
+    def _iterate_values(self) -> Iterator[int]:
+        width = self.bits_per_element
+        mask = (1 << width) - 1
+        # A chunk of `width * 8` bytes holds 64 whole elements, shifting small
+        # words keeps the cost linear in the memory size
+        chunk = width * 8
+        shifts = range(chunk * 8 - width, -1, -width)
+        for offset in range(0, len(self._memory), chunk):
+            data = self.view[offset : offset + chunk]
+            word = int.from_bytes(data, "big") << (chunk - len(data)) * 8
+            for shift in shifts:
+                yield (word >> shift) & mask
+
+    def copy(self) -> "PackedMemory":
+        """Get an independent copy of the memory."""
+        return PackedMemory(
+            self.element_count, self.bits_per_element, bytearray(self.as_bytes())
+        )
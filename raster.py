@@ -0,0 +1,115 @@
+"""Raster compositing of the display, for layouts with very many segments.
+
+Each segment is rasterised once into an index map, a frame is then composited
+from the display state with a single vectorised palette lookup. Needs numpy.
+"""
+import struct
+import zlib
+from typing import Optional, Sequence
+
+import numpy as np
+
+from palette import (  # noqa: F401 re-exported
+    TRANSPARENT,
+    Color,
+    PaletteSpec,
+    make_palette,
+    parse_color,
+)
+from ram_memory import RamMemory
+
+
+def rasterise(shapes: Sequence, width: int, height: int) -> np.ndarray:
+    """Get a height x width map with the index of the shape covering each pixel.
+
+    A pixel belongs to a shape when its center is inside it, where shapes overlap
+    the last one wins like on a Tk canvas. Uncovered pixels are -1.
+    """
+    index_map = np.full((height, width), -1, dtype=np.int32)
+    for idx, shape in enumerate(shapes):
+        coords = np.asarray(shape.coords, dtype=np.float64)
+        xs, ys = coords[0::2], coords[1::2]
+        col1, col2 = max(0, int(xs.min())), min(width, int(np.ceil(xs.max())) + 1)
+        row1, row2 = max(0, int(ys.min())), min(height, int(np.ceil(ys.max())) + 1)
+        if col1 >= col2 or row1 >= row2:
+            continue
+        centers_x = np.arange(col1, col2) + 0.5
+        centers_y = np.arange(row1, row2)[:, None] + 0.5
+
+        if shape.kind == "rect":
+            inside = (
+                (centers_x >= xs[0]) & (centers_x < xs[1])
+                & (centers_y >= ys[0]) & (centers_y < ys[1])
+            )  # fmt: skip
+        else:
+            inside = np.zeros((row2 - row1, col2 - col1), dtype=bool)
+            for x1, y1, x2, y2 in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+                if y1 == y2:
+                    continue
+                crosses = (y1 > centers_y) != (y2 > centers_y)
+                x_cross = (x2 - x1) * (centers_y - y1) / (y2 - y1) + x1
+                inside ^= crosses & (centers_x < x_cross)
+
+        index_map[row1:row2, col1:col2][inside] = idx
+    return index_map
+
+
+def encode_png(rgba: np.ndarray, compression: int = 1) -> bytes:
+    """Encode a height x width x 4 uint8 array as PNG."""
+    height, width, _ = rgba.shape
+    # Every scanline starts with filter type 0, no filtering
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(scanlines.tobytes(), compression)),
+            chunk(b"IEND", b""),
+        )
+    )
+
+
+class RasterRenderer:
+    """Composites frames of the display from a pre-rasterised index map.
+
+    Segments are colored by their value in `palette`, by default `off_color`
+    for 0 and `on_color` for 1, see `palette` for displays of several bits per
+    segment.
+    """
+
+    def __init__(
+        self,
+        layout,
+        width: int = 0,
+        height: int = 0,
+        on_color: Color = "black",
+        off_color: Color = "",
+        background: Color = "",
+        palette: Optional[PaletteSpec] = None,
+    ):
+        self.width = width or layout.width
+        self.height = height or layout.height
+        self.index_map = rasterise(layout.segments, self.width, self.height)
+        self.segment_count = len(layout.segments)
+        self.palette = make_palette(palette or (off_color, on_color))
+        # Lookup table of one color per segment, the last row is the background
+        self._palette = np.empty((self.segment_count + 1, 4), dtype=np.uint8)
+        self._palette[-1] = parse_color(background)
+
+    def compose(self, display_state: RamMemory) -> np.ndarray:
+        """Get the frame buffer of a display state as height x width x 4 RGBA."""
+        values = display_state.unpack_elements()[: self.segment_count]
+        # A palette per frame, views and snapshots may compose on different threads
+        palette = self._palette.copy()
+        palette[:-1] = self.palette.colors(values)
+        return palette[self.index_map]
+
+    def render_png(self, display_state: RamMemory) -> bytes:
+        """Get a PNG image of a display state."""
+        return encode_png(self.compose(display_state))
@@ -6,6 +6,26 @@ setup(
     description="A custom LCD package",
     author="Ben Spoor",
     packages=find_packages(),
-    python_requires=">=3.6",
+    py_modules=[
+        "bus_timing",
+        "custom_lcd",
+        "fleet",
+        "glyphs",
+        "layout",
+        "layout_cache",
+        "lcd_client",
+        "lcd_core",
+        "lcd_protocol",
+        "lcd_stats",
+        "palette",
+        "ram_memory",
+        "raster",
+        "shared_ram",
+        "spatial_index",
+        "traffic_log",
+        "virtual_time",
+    ],
+    python_requires=">=3.8",
     install_requires=["pyzmq==25.0.2", "svg.path==6.2"],
+    extras_require={"numpy": ["numpy"]},
 )
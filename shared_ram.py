@@ -0,0 +1,209 @@
+"""Shared memory transport of the display and touch RAM, for clients on the same host.
+
+The simulator creates one shared memory block holding a header, the display RAM
+and the touch RAM. Each RAM has a sequence counter that is odd while it is being
+written, so readers copy a consistent snapshot by retrying until the counter was
+the same even value before and after the copy (a seqlock). A seqlock allows a
+single writer per RAM: the simulator for the touch RAM, and either a local client
+or ZeroMQ clients for the display RAM.
+
+Local clients read and write the RAM in place, without a copy or syscall per
+access, and ring the doorbell, a ZeroMQ PUSH socket, after writing the display
+so the simulator redraws the changed segments.
+"""
+import functools
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+import zmq
+
+from lcd_protocol import DEFAULT_DOORBELL_ENDPOINT, DEFAULT_SHARED_MEMORY_NAME
+from ram_memory import RamMemory
+
+MAGIC = b"LCDS"
+FORMAT_VERSION = 1
+# Magic, version, display and touch bit counts, display and touch sequence
+HEADER = struct.Struct("<4sH2xIIII")
+DISPLAY_SEQUENCE_OFFSET = 16
+TOUCH_SEQUENCE_OFFSET = 20
+# Longest a reader retries for a consistent copy before giving up on the writer
+READ_TIMEOUT = 1.0
+
+
+def _write_locked(method):
+    """Make the sequence counter odd while `method` writes the memory."""
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        if self._writing:
+            return method(self, *args, **kwargs)
+        self._writing = True
+        self.sequence[0] = (self.sequence[0] + 1) & 0xFFFFFFFF
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.sequence[0] = (self.sequence[0] + 1) & 0xFFFFFFFF
+            self._writing = False
+
+    return locked
+
+
+class SharedRamMemory(RamMemory):
+    """RAM memory in a shared buffer, guarded by a seqlock sequence counter."""
+
+    def __init__(self, bit_count: int, buffer: memoryview, sequence: memoryview):
+        super().__init__(bit_count, buffer)
+        self.sequence = sequence
+        self._writing = False
+
+    _combine_range = _write_locked(RamMemory._combine_range)
+    set_bit = _write_locked(RamMemory.set_bit)
+    clear_bit = _write_locked(RamMemory.clear_bit)
+    toggle_bit = _write_locked(RamMemory.toggle_bit)
+    set_bits = _write_locked(RamMemory.set_bits)
+    clear_bits = _write_locked(RamMemory.clear_bits)
+    toggle_bits = _write_locked(RamMemory.toggle_bits)
+    clear = _write_locked(RamMemory.clear)
+
+    def as_bytes(self, timeout: float = READ_TIMEOUT) -> bytes:
+        """Get a consistent copy of the memory, retrying while it is written.
+
+        Raises TimeoutError when no consistent copy was read within `timeout`
+        seconds, like when the writer died while writing.
+        """
+        deadline = None
+        while True:
+            before = self.sequence[0]
+            if not before & 1:
+                data = bytes(self._memory)
+                if self.sequence[0] == before:
+                    return data
+            # Only a retry reads the clock
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f"RAM still being written after {timeout} s")
+
+    def release(self) -> None:
+        """Release the views on the shared buffer, the memory is unusable after."""
+        self.view.release()
+        self._memory.release()
+        self.sequence.release()
+
+
+class SharedRam:
+    """The shared memory block of a simulator, with its display and touch RAM.
+
+    Use `create` in the simulator and `attach` in the clients.
+    """
+
+    def __init__(self, block: shared_memory.SharedMemory, owner: bool):
+        self.block = block
+        self.owner = owner
+        magic, version, display_bits, touch_bits, _, _ = HEADER.unpack_from(block.buf)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{block.name} is not a version {FORMAT_VERSION} block")
+        display_start = HEADER.size
+        touch_start = display_start + (display_bits + 7) // 8
+        touch_end = touch_start + (touch_bits + 7) // 8
+        self.display = SharedRamMemory(
+            display_bits,
+            block.buf[display_start:touch_start],
+            block.buf[DISPLAY_SEQUENCE_OFFSET : DISPLAY_SEQUENCE_OFFSET + 4].cast("I"),
+        )
+        self.touch = SharedRamMemory(
+            touch_bits,
+            block.buf[touch_start:touch_end],
+            block.buf[TOUCH_SEQUENCE_OFFSET : TOUCH_SEQUENCE_OFFSET + 4].cast("I"),
+        )
+
+    @classmethod
+    def create(
+        cls, name: str, display_bits: int, touch_bits: int, replace: bool = True
+    ) -> "SharedRam":
+        """Create the block, replacing one left behind by a crashed simulator."""
+        size = HEADER.size + (display_bits + 7) // 8 + (touch_bits + 7) // 8
+        try:
+            block = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            block = shared_memory.SharedMemory(name, create=True, size=size)
+        HEADER.pack_into(
+            block.buf, 0, MAGIC, FORMAT_VERSION, display_bits, touch_bits, 0, 0
+        )
+        return cls(block, owner=True)
+
+    @classmethod
+    def attach(cls, name: str = DEFAULT_SHARED_MEMORY_NAME) -> "SharedRam":
+        """Attach to the block of a running simulator."""
+        try:
+            block = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13 the resource tracker unlinks attached blocks on exit
+            block = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(block._name, "shared_memory")
+        return cls(block, owner=False)
+
+    def close(self) -> None:
+        """Detach from the block, the simulator also removes it."""
+        self.display.release()
+        self.touch.release()
+        self.block.close()
+        if self.owner:
+            self.block.unlink()
+
+
+class SharedRamClient:
+    """Local client reading and writing the RAM of a simulator in place.
+
+    Write `display` with the `RamMemory` methods and `ring` the doorbell after,
+    or use `write_all`. Reads of single bits need no copy, `read_display` and
+    `read_touch` get consistent snapshots. The touch RAM is only written by the
+    simulator, clear it with `I2C_TOUCH_READ_CMD` over ZeroMQ.
+    """
+
+    def __init__(
+        self,
+        name: str = DEFAULT_SHARED_MEMORY_NAME,
+        doorbell_endpoint: str = DEFAULT_DOORBELL_ENDPOINT,
+        context: Optional[zmq.Context] = None,
+    ):
+        self.shared = SharedRam.attach(name)
+        self.display = self.shared.display
+        self.touch = self.shared.touch
+        self.doorbell = (context or zmq.Context.instance()).socket(zmq.PUSH)
+        self.doorbell.setsockopt(zmq.LINGER, 0)
+        # Rings are only hints, drop them rather than block a writer
+        self.doorbell.setsockopt(zmq.SNDHWM, 1)
+        self.doorbell.connect(doorbell_endpoint)
+
+    def ring(self) -> None:
+        """Tell the simulator the display RAM changed."""
+        try:
+            self.doorbell.send(b"", flags=zmq.NOBLOCK)
+        except zmq.Again:
+            pass
+
+    def write_all(self, data: bytes) -> None:
+        """Overwrite the display RAM and ring the doorbell."""
+        if self.display.write_from_bytes(data):
+            self.ring()
+
+    def read_display(self) -> bytes:
+        """Get a consistent copy of the display RAM."""
+        return self.display.as_bytes()
+
+    def read_touch(self) -> bytes:
+        """Get a consistent copy of the touch RAM, without clearing it."""
+        return self.touch.as_bytes()
+
+    def close(self) -> None:
+        """Close the doorbell and detach from the shared memory."""
+        self.doorbell.close()
+        self.shared.close()
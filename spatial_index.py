@@ -0,0 +1,65 @@
+"""Uniform grid index for point queries on layout shapes."""
+import math
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+
+def bounding_box(coords: Sequence[float]) -> Tuple[float, float, float, float]:
+    """Get (x1, y1, x2, y2) enclosing flat coordinates."""
+    xs, ys = coords[0::2], coords[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_polygon(x: float, y: float, coords: Sequence[float]) -> bool:
+    """Even-odd rule test of a point against a polygon with flat coordinates."""
+    inside = False
+    x1, y1 = coords[-2], coords[-1]
+    for idx in range(0, len(coords), 2):
+        x2, y2 = coords[idx], coords[idx + 1]
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+class ShapeIndex:
+    """Grid of cells, each listing the shapes whose bounding box overlaps it.
+
+    The cell size is chosen so there are about as many cells as shapes, a point
+    query then only tests the few shapes registered in its cell.
+    """
+
+    def __init__(self, shapes: Sequence, cell_size: float = 0):
+        self.shapes = shapes
+        self.boxes = [bounding_box(shape.coords) for shape in shapes]
+        self.cell_size = cell_size or self._default_cell_size()
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+        for idx, (x1, y1, x2, y2) in enumerate(self.boxes):
+            col1, row1 = self._cell(x1, y1)
+            col2, row2 = self._cell(x2, y2)
+            for col in range(col1, col2 + 1):
+                for row in range(row1, row2 + 1):
+                    self._cells[col, row].append(idx)
+
+    def _default_cell_size(self) -> float:
+        if not self.boxes:
+            return 1.0
+        width = max(box[2] for box in self.boxes) - min(box[0] for box in self.boxes)
+        height = max(box[3] for box in self.boxes) - min(box[1] for box in self.boxes)
+        return max(1.0, math.sqrt(width * height / len(self.boxes)))
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def query(self, x: float, y: float) -> List[int]:
+        """Get the indices of all shapes containing the point, in shape order."""
+        hits = []
+        for idx in self._cells.get(self._cell(x, y), ()):
+            x1, y1, x2, y2 = self.boxes[idx]
+            if not (x1 <= x <= x2 and y1 <= y <= y2):
+                continue
+            shape = self.shapes[idx]
+            if shape.kind == "rect" or point_in_polygon(x, y, shape.coords):
+                hits.append(idx)
+        return hits
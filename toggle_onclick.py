@@ -1,20 +1,23 @@
-import zmq
+import asyncio
 
-import custom_lcd
+import lcd_client
 
-context = zmq.Context()
-socket = context.socket(zmq.REQ)
-socket.connect("tcp://localhost:5555")
 
-socket.send(bytes((custom_lcd.I2C_LCD_ADDRESS, custom_lcd.I2C_LCD_READ_CMD)))
-led_state = socket.recv()
+async def main():
+    client = lcd_client.AsyncLcdClient(
+        timeout=1.0,
+        retries=3,
+        interrupt_endpoint=lcd_client.DEFAULT_INTERRUPT_CONNECT_ENDPOINT,
+    )
+    led_state = await client.read_display()
 
-while True:
-    socket.send(bytes((custom_lcd.I2C_TOUCH_ADDRESS, custom_lcd.I2C_TOUCH_READ_CMD)))
-    touch_state = socket.recv()
-    led_state = bytes(a ^ b for a, b in zip(led_state, touch_state))
+    while True:
+        events = await client.wait_touch_events()
+        pressed = [event.index for event in events if event.pressed]
+        if pressed:
+            touch_state = lcd_client.pack_bits(pressed, len(led_state) * 8)
+            led_state = bytes(a ^ b for a, b in zip(led_state, touch_state))
+            await client.write_all(led_state)
 
-    socket.send(
-        bytes((custom_lcd.I2C_LCD_ADDRESS, custom_lcd.I2C_LCD_WRITE_CMD)) + led_state
-    )
-    touch_state = socket.recv()
+
+asyncio.run(main())
@@ -0,0 +1,204 @@
+"""Compact binary log of the bus traffic of a simulator, and its replay.
+
+The log starts with `MAGIC` and the format version, followed by records of a
+kind byte, a monotonic timestamp in nanoseconds, a payload length and the
+payload. Requests and replies carry the message, touch events the touch
+controller address, the event timestamp in microseconds, the surface and
+whether it was pressed. Replay a log against a headless simulator with:
+
+    python traffic_log.py traffic.lcdlog --mask Masked.svg --pace
+"""
+import argparse
+import mmap
+import struct
+import time
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from lcd_client import PipelinedClient
+from lcd_protocol import TouchEvent
+
+MAGIC = b"LCDT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">4sH")
+RECORD = struct.Struct(">BQI")
+TOUCH_PAYLOAD = struct.Struct(">BQHB")
+
+REQUEST = 1
+REPLY = 2
+TOUCH = 3
+
+# Buffered appends, a request and reply cost one memcpy each until the flush
+BUFFER_SIZE = 1 << 16
+
+
+class TrafficRecorder:
+    """Appends requests, replies and touch events to a traffic log."""
+
+    def __init__(self, path: str, buffer_size: int = BUFFER_SIZE):
+        self._log = open(path, "wb", buffering=buffer_size)
+        self._log.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+
+    def record(self, kind: int, payload: bytes) -> None:
+        """Append a record timestamped now."""
+        self._log.write(RECORD.pack(kind, time.monotonic_ns(), len(payload)))
+        self._log.write(payload)
+
+    def touch(self, address: int, event: TouchEvent) -> None:
+        """Append a touch event of the touch controller at `address`."""
+        self.record(
+            TOUCH,
+            TOUCH_PAYLOAD.pack(address, event.timestamp_us, event.index, event.pressed),
+        )
+
+    def flush(self) -> None:
+        """Write the buffered records to the file."""
+        self._log.flush()
+
+    def close(self) -> None:
+        """Flush and close the log."""
+        self._log.close()
+
+
+def read_log(path: str) -> Iterator[Tuple[int, int, bytes]]:
+    """Iterate over the kind, timestamp and payload of the records in a log.
+
+    The log is memory mapped. A truncated last record, as left by a crash, is
+    skipped.
+    """
+    with open(path, "rb") as log:
+        if not log.read(HEADER.size):
+            raise ValueError(f"{path} is empty")
+        with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version = HEADER.unpack_from(data)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a version {FORMAT_VERSION} log")
+            position = HEADER.size
+            while position + RECORD.size <= len(data):
+                kind, timestamp, length = RECORD.unpack_from(data, position)
+                start = position + RECORD.size
+                position = start + length
+                if position > len(data):
+                    break
+                yield kind, timestamp, data[start:position]
+
+
+class ReplayResult(NamedTuple):
+    """Outcome of a replay."""
+
+    requests: int
+    mismatches: int
+    seconds: float
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+
+class _Pacer:
+    """Sleeps until the recorded time offset of each record has passed."""
+
+    def __init__(self):
+        self._offset: Optional[int] = None
+
+    def wait(self, timestamp: int) -> None:
+        if self._offset is None:
+            self._offset = time.monotonic_ns() - timestamp
+            return
+        delay = timestamp + self._offset - time.monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+
+
+def replay(path: str, simulator, pace: bool = False) -> ReplayResult:
+    """Drive a simulator in this process with a log and compare the replies.
+
+    Touch events are injected with their recorded timestamps, so a fresh
+    simulator with the same layout gives the recorded replies. Without `pace`
+    the log is replayed as fast as possible.
+    """
+    pacer = _Pacer() if pace else None
+    requests = mismatches = 0
+    reply = None
+    start = time.perf_counter()
+    for kind, timestamp, payload in read_log(path):
+        if pacer is not None:
+            pacer.wait(timestamp)
+        if kind == REQUEST:
+            reply = simulator.process_message(payload)
+            requests += 1
+        elif kind == REPLY:
+            mismatches += reply != payload
+        elif kind == TOUCH:
+            address, timestamp_us, index, pressed = TOUCH_PAYLOAD.unpack(payload)
+            device = simulator.bus[address]
+            if pressed:
+                device.press(index, timestamp_us)
+            else:
+                device.release(index, timestamp_us)
+    return ReplayResult(requests, mismatches, time.perf_counter() - start)
+
+
+def _collect(client: PipelinedClient, in_flight: List[List]) -> int:
+    """Wait for the replies in flight and get how many differ from the recorded."""
+    mismatches = sum(client.reply(sent) != recorded for sent, recorded in in_flight)
+    in_flight.clear()
+    return mismatches
+
+
+def replay_remote(
+    path: str, endpoint: str, pace: bool = False, window: int = 64
+) -> ReplayResult:
+    """Send the requests of a log to a running simulator as a load generator.
+
+    Without `pace` up to `window` requests are kept in flight. Touch events
+    cannot be injected remotely and are skipped.
+    """
+    client = PipelinedClient(endpoint, window=1 if pace else window)
+    pacer = _Pacer() if pace else None
+    in_flight = []
+    requests = mismatches = 0
+    start = time.perf_counter()
+    for kind, timestamp, payload in read_log(path):
+        if kind == REQUEST:
+            # Collect the replies in batches to bound the memory
+            if len(in_flight) >= window * 16:
+                mismatches += _collect(client, in_flight)
+            if pacer is not None:
+                pacer.wait(timestamp)
+            in_flight.append([client.send(payload), None])
+            requests += 1
+        elif kind == REPLY and in_flight:
+            in_flight[-1][1] = payload
+    mismatches += _collect(client, in_flight)
+    seconds = time.perf_counter() - start
+    client.close()
+    return ReplayResult(requests, mismatches, seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log")
+    parser.add_argument("--mask", default="Masked.svg")
+    parser.add_argument(
+        "--pace", action="store_true", help="replay at the recorded pace"
+    )
+    parser.add_argument(
+        "--endpoint", help="send the requests to a running simulator instead"
+    )
+    args = parser.parse_args()
+
+    if args.endpoint:
+        result = replay_remote(args.log, args.endpoint, pace=args.pace)
+    else:
+        from layout_cache import load_layout_cached
+        from lcd_core import LcdSimulator
+
+        simulator = LcdSimulator(
+            load_layout_cached(args.mask), endpoint="inproc://traffic_log"
+        )
+        result = replay(args.log, simulator, pace=args.pace)
+    print(
+        f"{result.requests} requests in {result.seconds:.3f} s,"
+        f" {result.requests_per_second:.1f} requests/s,"
+        f" {result.mismatches} replies differ"
+    )
@@ -0,0 +1,200 @@
+"""Deterministic simulation on a virtual clock, faster than real time.
+
+Bus messages, touch scripts and frame ticks are events on a virtual timeline.
+They run in this thread, in time order, and events at the same time run in the
+order they were scheduled. The clock jumps from one event to the next, so
+minutes of device time take only as long as the CPU needs, and every run sees
+the same ordering and the same touch event timestamps:
+
+    simulation = VirtualSimulation(LcdSimulator(layout, endpoint="inproc://virtual"))
+    simulation.schedule_touches([(0.5, 1, True), (0.6, 1, False)])
+    simulation.run_for(0.5)
+    events = simulation.request(touch_events_request(I2C_TOUCH_ADDRESS, 0))
+
+Messages sent over the ZeroMQ socket are not part of the timeline, drive the
+bus with `request` and `schedule_message` instead.
+"""
+import heapq
+import itertools
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from bus_timing import BusProfiler
+from lcd_core import DEFAULT_REFRESH_RATE, FrameCoalescer, LcdSimulator, TouchDevice
+
+FrameCallback = Callable[[float, Set[int]], None]
+
+
+class VirtualClock:
+    """Clock that only advances when told to, running the events due on the way.
+
+    Time is kept in integer nanoseconds so long runs do not accumulate rounding.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self.now_ns = round(start * 1e9)
+        self._events: List[Tuple[int, int, Callable, tuple]] = []
+        self._order = itertools.count()
+        # Whether events are being run, so they cannot run the clock again
+        self.running = False
+
+    @property
+    def now(self) -> float:
+        """Get the virtual time in seconds."""
+        return self.now_ns / 1e9
+
+    def now_us(self) -> int:
+        """Get the virtual time in microseconds, as touch event timestamps."""
+        return self.now_ns // 1000
+
+    def call_at(self, when: float, callback: Callable, *args) -> None:
+        """Run `callback(*args)` at virtual time `when`, or now if it has passed."""
+        self.call_at_ns(round(when * 1e9), callback, *args)
+
+    def call_at_ns(self, when_ns: int, callback: Callable, *args) -> None:
+        """Run `callback(*args)` at virtual time `when_ns` in nanoseconds."""
+        when_ns = max(when_ns, self.now_ns)
+        heapq.heappush(self._events, (when_ns, next(self._order), callback, args))
+
+    def call_later(self, delay: float, callback: Callable, *args) -> None:
+        """Run `callback(*args)` after `delay` virtual seconds."""
+        self.call_at(self.now + delay, callback, *args)
+
+    def next_event(self) -> Optional[float]:
+        """Get the time of the next event, None when none is scheduled."""
+        return self._events[0][0] / 1e9 if self._events else None
+
+    def run_until(self, when: float) -> int:
+        """Run all events due up to `when`, end there and get the number run."""
+        if self.running:
+            raise RuntimeError("The clock cannot be run from one of its events")
+        end_ns = round(when * 1e9)
+        ran = 0
+        self.running = True
+        try:
+            while self._events and self._events[0][0] <= end_ns:
+                self.now_ns, _, callback, args = heapq.heappop(self._events)
+                callback(*args)
+                ran += 1
+        finally:
+            self.running = False
+        self.now_ns = max(self.now_ns, end_ns)
+        return ran
+
+    def run_for(self, seconds: float) -> int:
+        """Run the events of the next `seconds` and get the number run."""
+        return self.run_until(self.now + seconds)
+
+
+class VirtualSimulation:
+    """Runs a simulator on a `VirtualClock`.
+
+    Touch events are timestamped with the virtual time. Display changes are
+    coalesced into frames at `refresh_rate` frames per virtual second and passed
+    to the frame subscribers, a refresh rate of 0 makes every write a frame.
+    Each `request` takes `message_time` virtual seconds, or with a
+    `bus_profiler` the time its transaction takes on the modelled I2C bus.
+    """
+
+    def __init__(
+        self,
+        simulator: LcdSimulator,
+        clock: Optional[VirtualClock] = None,
+        refresh_rate: float = DEFAULT_REFRESH_RATE,
+        message_time: float = 0.0,
+        bus_profiler: Optional[BusProfiler] = None,
+    ):
+        self.simulator = simulator
+        self.clock = clock or VirtualClock()
+        self.message_time = message_time
+        self.bus_profiler = bus_profiler
+        for device in simulator.bus.devices.values():
+            if isinstance(device, TouchDevice):
+                device.events.clock = self.clock.now_us
+
+        self.frames = FrameCoalescer()
+        self.frame_interval_ns = round(1e9 / refresh_rate) if refresh_rate else 0
+        self._frame_scheduled = False
+        self._frame_subscribers: List[FrameCallback] = []
+        simulator.lcd.subscribe(self._display_changed)
+
+    @property
+    def now(self) -> float:
+        """Get the virtual time in seconds."""
+        return self.clock.now
+
+    def subscribe_frames(self, callback: FrameCallback) -> None:
+        """Call `callback` with the time and changed segments of every frame."""
+        self._frame_subscribers.append(callback)
+
+    def request(self, message: bytes) -> bytes:
+        """Process a message now, then let its bus time pass, and get the reply.
+
+        Called from an event of the timeline the clock is not advanced, schedule
+        the message with `schedule_message` to charge its bus time there.
+        """
+        reply, duration = self._process(message)
+        if duration and not self.clock.running:
+            self.clock.run_for(duration)
+        return reply
+
+    def schedule_message(
+        self,
+        when: float,
+        message: bytes,
+        callback: Optional[Callable[[bytes], None]] = None,
+    ) -> None:
+        """Process a message at virtual time `when`, passing the reply to `callback`
+        once the bus time of the message has passed."""
+        self.clock.call_at(when, self._deliver, message, callback)
+
+    def schedule_touches(
+        self, script: Iterable[Tuple[float, int, bool]], address: Optional[int] = None
+    ) -> None:
+        """Schedule presses and releases of surfaces, as (time, index, pressed).
+
+        The touch controller at `address` is used, by default the one of the
+        simulator layout.
+        """
+        device = (
+            self.simulator.touch if address is None else self.simulator.bus[address]
+        )
+        for when, index, pressed in script:
+            self.clock.call_at(when, device.press if pressed else device.release, index)
+
+    def run_until(self, when: float) -> int:
+        """Run the simulation up to virtual time `when` and get the events run."""
+        return self.clock.run_until(when)
+
+    def run_for(self, seconds: float) -> int:
+        """Run the simulation for `seconds` virtual seconds and get the events run."""
+        return self.clock.run_for(seconds)
+
+    def _process(self, message: bytes) -> Tuple[bytes, float]:
+        reply = self.simulator.process_message(message)
+        self.simulator.transaction_count += 1
+        duration = self.message_time
+        if self.bus_profiler is not None:
+            acked = bool(message) and message[0] in self.simulator.bus
+            duration = self.bus_profiler.record(message, reply, self.clock.now, acked)
+        return reply, duration
+
+    def _deliver(self, message: bytes, callback: Optional[Callable]) -> None:
+        reply, duration = self._process(message)
+        if callback is not None:
+            self.clock.call_later(duration, callback, reply)
+
+    def _display_changed(self, changed: Iterable[int]) -> None:
+        self.frames.add(changed)
+        if not self.frame_interval_ns:
+            self._render_frame()
+        elif not self._frame_scheduled:
+            # Frames tick on multiples of the frame interval
+            self._frame_scheduled = True
+            tick = -(-self.clock.now_ns // self.frame_interval_ns)
+            self.clock.call_at_ns(tick * self.frame_interval_ns, self._render_frame)
+
+    def _render_frame(self) -> None:
+        self._frame_scheduled = False
+        changed = self.frames.take()
+        for callback in self._frame_subscribers:
+            callback(self.clock.now, changed)